@@ -13,21 +13,56 @@ module AssemblyAPI {
 
     typedef tuple<string column, boolean ascending> column_sorting;
 
+    /*
+        min, max - inclusive bounds of the range, either one can be
+            omitted.
+    */
+    typedef structure {
+        float min;
+        float max;
+    } NumericRange;
+
+    /*
+        Filters on numeric contig properties, a contig has to match all
+        the given filters (contigs with unknown values never match).
+        is_circ - 0 or 1
+    */
+    typedef structure {
+        NumericRange length;
+        NumericRange gc;
+        NumericRange N_count;
+        boolean is_circ;
+    } ContigFilters;
+
 
     /*
-        num_found - optional field which when set informs that there
-            is no need to perform full scan in order to count this
-            value because it was already done before; please don't
-            set this value with 0 or any guessed number if you didn't 
-            get right value previously.
+        query - words or "quoted phrases" to look for (case-insensitively)
+            in the contig ids and descriptions, a contig has to match all of
+            them. Terms can also be scoped to a field: contig_id:NODE_1 and
+            md5:abc match the whole value (contig_id:NODE_1* its beginning),
+            description:"plasmid" text contained in the description.
+        num_found - deprecated and ignored, the number of matches of
+            recent queries is cached on the server side.
+        cursor - optional continuation cursor returned by a previous call
+            with the same ref, query, filters and sort_by; when set the search
+            resumes right after the last contig of that page and "start"
+            is ignored.
+        filters - optional numeric filters combined with the query.
+        refs - optional list of assemblies searched at once instead of "ref",
+            the results of all of them are merged in sort_by order and
+            num_found counts the matches of all of them. At most 20 refs
+            (search-max-refs in deploy.cfg) can be searched at once.
     */
     typedef structure {
         string ref;
+        list<string> refs;
         string query;
         list<column_sorting> sort_by;
         int start;
         int limit;
         int num_found;
+        string cursor;
+        ContigFilters filters;
     } SearchAssemblyOptions;
 
     /* 
@@ -39,9 +74,11 @@ module AssemblyAPI {
                   if unknown
         N_count - number of 'N' bases in the contig
         md5 - md5 checksum of the sequence
-
+        ref - reference of the assembly of the contig (only set by searches
+              over a list of refs)
     */
     typedef structure {
+        string ref;
         string contig_id;
         string description;
         int length;
@@ -54,17 +91,120 @@ module AssemblyAPI {
     /*
         num_found - number of all items found in query search (with 
             only part of it returned in "bins" list).
+        cursor - opaque cursor to pass back in SearchAssemblyOptions to
+            get the next page, null if there are no more contigs.
     */
     typedef structure {
         string query;
         int start;
         list<AssemblyData> contigs;
         int num_found;
+        string cursor;
     } SearchAssemblyResult;
 
     funcdef search_contigs(SearchAssemblyOptions params) 
         returns (SearchAssemblyResult result) authentication optional;
 
+    /*
+        ref - reference to an assembly or a contig set
+        query, filters - select the contigs to summarize, the same way as
+            in SearchAssemblyOptions
+        columns - numeric columns to summarize (length, gc, N_count),
+            all of them by default
+        num_bins - number of histogram bins of each column (default 20)
+        quantiles - quantiles (between 0 and 1) reported for each column,
+            [0.1, 0.25, 0.5, 0.75, 0.9] by default
+    */
+    typedef structure {
+        string ref;
+        string query;
+        ContigFilters filters;
+        list<string> columns;
+        int num_bins;
+        list<float> quantiles;
+    } SummarizeContigsOptions;
+
+    /*
+        bin_edges - num_bins + 1 increasing bin edges, every bin includes
+            its lower edge, the last one also its upper edge
+        counts - number of values within each bin
+    */
+    typedef structure {
+        list<float> bin_edges;
+        list<int> counts;
+    } Histogram;
+
+    /*
+        count - number of contigs with a known value of the column
+        quantiles - values of the requested quantiles (linear interpolation
+            between the closest values)
+    */
+    typedef structure {
+        int count;
+        float sum;
+        float min;
+        float max;
+        float mean;
+        list<float> quantiles;
+        Histogram histogram;
+    } ColumnSummary;
+
+    /*
+        num_found - number of matching contigs
+        columns - summary of each requested column over the matching
+            contigs
+        total_length - (bp) total length of the matching contigs
+        n50, l50 - N50 and L50 of the lengths of the matching contigs
+    */
+    typedef structure {
+        string query;
+        int num_found;
+        mapping<string, ColumnSummary> columns;
+        int total_length;
+        int n50;
+        int l50;
+    } ContigsSummary;
+
+    funcdef summarize_contigs(SummarizeContigsOptions params)
+        returns (ContigsSummary result) authentication optional;
+
+    /*
+        refs - references to assemblies or contig sets
+    */
+    typedef structure {
+        list<string> refs;
+    } IndexRefsParams;
+
+    /*
+        status - state of the search index of the ref on this node, one of
+            "queued", "building", "ready", "failed", "rejected" (the
+            prewarm queue was full) or "not_indexed"
+        error - error message of a failed build
+    */
+    typedef structure {
+        string ref;
+        string status;
+        string error;
+    } IndexStatus;
+
+    typedef structure {
+        list<IndexStatus> statuses;
+    } IndexStatusResult;
+
+    /*
+        Build the search indexes of the assemblies (and their common sort
+        orders) in the background, ahead of the first search_contigs call.
+        Restricted to the admins of the service (prewarm-admins in deploy.cfg).
+    */
+    funcdef prewarm_indexes(IndexRefsParams params)
+        returns (IndexStatusResult result) authentication required;
+
+    /*
+        Report whether the search indexes of the assemblies are ready.
+    */
+    funcdef get_index_status(IndexRefsParams params)
+        returns (IndexStatusResult result) authentication optional;
+
 
 
 
@@ -4,6 +4,7 @@ import logging
 
 from AssemblyAPI.AssemblyIndexer import AssemblyIndexer
 from AssemblyAPI.AssemblySequence import AssemblySequenceCache
+from AssemblyAPI.IndexPrewarmer import IndexPrewarmer
 from AssemblyAPI import Utils
 from installed_clients.WorkspaceClient import Workspace
 
@@ -51,7 +52,13 @@ class AssemblyAPI:
                 "handle_service_url": self.handleURL,
             }
         self.indexer = AssemblyIndexer(config)
-        self.seq_cache = AssemblySequenceCache(self.workspaceURL, self.shockURL)
+        self.prewarmer = IndexPrewarmer(self.indexer, config)
+        self.prewarmer.start_on_startup()
+        self.seq_cache = AssemblySequenceCache(
+            self.workspaceURL, self.shockURL,
+            max_cache_bytes=int(config.get('sequence-cache-max-bytes', 0)),
+            codec=config.get('sequence-cache-codec', 'gzip'),
+            sequence_format=config.get('sequence-cache-format', 'packed'))
 
         #END_CONSTRUCTOR
         pass
@@ -59,31 +66,60 @@ class AssemblyAPI:
 
     def search_contigs(self, ctx, params):
         """
-        :param params: instance of type "SearchAssemblyOptions" (num_found -
-           optional field which when set informs that there is no need to
-           perform full scan in order to count this value because it was
-           already done before; please don't set this value with 0 or any
-           guessed number if you didn't get right value previously.) ->
-           structure: parameter "ref" of String, parameter "query" of String,
+        :param params: instance of type "SearchAssemblyOptions" (query - words
+           or "quoted phrases" to look for (case-insensitively) in the contig
+           ids and descriptions, a contig has to match all of them. Terms can
+           also be scoped to a field: contig_id:NODE_1 and md5:abc match the
+           whole value (contig_id:NODE_1* its beginning),
+           description:"plasmid" text contained in the description. num_found
+           - deprecated and ignored, the number of matches of recent queries
+           is cached on the server side. cursor - optional continuation cursor
+           returned by a previous call with the same ref, query, filters and
+           sort_by; when set the search resumes right after the last contig of
+           that page and "start" is ignored. filters - optional numeric
+           filters combined with the query. refs - optional list of assemblies
+           searched at once instead of "ref", the results of all of them are
+           merged in sort_by order and num_found counts the matches of all of
+           them. At most 20 refs (search-max-refs in deploy.cfg) can be
+           searched at once.) -> structure: parameter "ref" of String,
+           parameter "refs" of list of String, parameter "query" of String,
            parameter "sort_by" of list of type "column_sorting" -> tuple of
            size 2: parameter "column" of String, parameter "ascending" of
            type "boolean" (Indicates true or false values, false = 0, true =
-           1 @range [0,1]), parameter "start" of Long, parameter "limit" of
-           Long, parameter "num_found" of Long
+           1 @range [0,1]),
+           parameter "start" of Long, parameter "limit" of Long, parameter
+           "num_found" of Long, parameter "cursor" of String, parameter
+           "filters" of type "ContigFilters" (Filters on numeric contig
+           properties, a contig has to match all the given filters (contigs
+           with unknown values never match). is_circ - 0 or 1) -> structure:
+           parameter "length" of type "NumericRange" (min, max - inclusive
+           bounds of the range, either one can be omitted.) -> structure:
+           parameter "min" of Double, parameter "max" of Double, parameter
+           "gc" of type "NumericRange" (min, max - inclusive bounds of the
+           range, either one can be omitted.) -> structure: parameter "min" of
+           Double, parameter "max" of Double, parameter "N_count" of type
+           "NumericRange" (min, max - inclusive bounds of the range, either
+           one can be omitted.) -> structure: parameter "min" of Double,
+           parameter "max" of Double, parameter "is_circ" of type "boolean"
+           (Indicates true or false values, false = 0, true = 1 @range [0,1])
         :returns: instance of type "SearchAssemblyResult" (num_found - number
            of all items found in query search (with only part of it returned
-           in "bins" list).) -> structure: parameter "query" of String,
-           parameter "start" of Long, parameter "contigs" of list of type
-           "AssemblyData" (contig_id - id of the contig description -
-           description of the contig (description on fasta header rows)
-           length - (bp) length of the contig gc - gc_content of the contig
-           is_circ - 0 or 1 value indicating if the contig is circular.  May
-           be null if unknown N_count - number of 'N' bases in the contig md5
-           - md5 checksum of the sequence) -> structure: parameter
-           "contig_id" of String, parameter "description" of String,
-           parameter "length" of Long, parameter "gc" of Long, parameter
-           "is_circ" of Long, parameter "N_count" of Long, parameter "md5" of
-           String, parameter "num_found" of Long
+           in "bins" list). cursor - opaque cursor to pass back in
+           SearchAssemblyOptions to get the next page, null if there are no
+           more contigs.) -> structure: parameter "query" of String, parameter
+           "start" of Long, parameter "contigs" of list of type "AssemblyData"
+           (contig_id - id of the contig description - description of the
+           contig (description on fasta header rows) length - (bp) length of
+           the contig gc - gc_content of the contig is_circ - 0 or 1 value
+           indicating if the contig is circular. May be null if unknown
+           N_count - number of 'N' bases in the contig md5 - md5 checksum of
+           the sequence ref - reference of the assembly of the contig (only
+           set by searches over a list of refs)) -> structure: parameter "ref"
+           of String, parameter "contig_id" of String, parameter "description"
+           of String, parameter "length" of Long, parameter "gc" of Long,
+           parameter "is_circ" of Long, parameter "N_count" of Long, parameter
+           "md5" of String, parameter "num_found" of Long, parameter "cursor"
+           of String
         """
         # ctx is the context object
         # return variables are: result
@@ -94,7 +130,10 @@ class AssemblyAPI:
                                              params.get("sort_by", None),
                                              params.get("start", None),
                                              params.get("limit", None),
-                                             params.get("num_found", None))
+                                             params.get("num_found", None),
+                                             params.get("cursor", None),
+                                             params.get("filters", None),
+                                             params.get("refs", None))
         #END search_contigs
 
         # At some point might do deeper type checking...
@@ -104,6 +143,128 @@ class AssemblyAPI:
         # return the results
         return [result]
 
+    def summarize_contigs(self, ctx, params):
+        """
+        :param params: instance of type "SummarizeContigsOptions" (ref -
+           reference to an assembly or a contig set query, filters - select
+           the contigs to summarize, the same way as in SearchAssemblyOptions
+           columns - numeric columns to summarize (length, gc, N_count), all
+           of them by default num_bins - number of histogram bins of each
+           column (default 20) quantiles - quantiles (between 0 and 1)
+           reported for each column, [0.1, 0.25, 0.5, 0.75, 0.9] by default)
+           -> structure: parameter "ref" of String, parameter "query" of
+           String, parameter "filters" of type "ContigFilters" (Filters on
+           numeric contig properties, a contig has to match all the given
+           filters (contigs with unknown values never match). is_circ - 0 or
+           1) -> structure: parameter "length" of type "NumericRange" (min,
+           max - inclusive bounds of the range, either one can be omitted.)
+           -> structure: parameter "min" of Double, parameter "max" of
+           Double, parameter "gc" of type "NumericRange" (min, max -
+           inclusive bounds of the range, either one can be omitted.) ->
+           structure: parameter "min" of Double, parameter "max" of Double,
+           parameter "N_count" of type "NumericRange" (min, max - inclusive
+           bounds of the range, either one can be omitted.) -> structure:
+           parameter "min" of Double, parameter "max" of Double, parameter
+           "is_circ" of type "boolean" (Indicates true or false values, false
+           = 0, true = 1 @range [0,1]), parameter "columns" of list of
+           String, parameter "num_bins" of Long, parameter "quantiles" of
+           list of Double
+        :returns: instance of type "ContigsSummary" (num_found - number of
+           matching contigs columns - summary of each requested column over
+           the matching contigs total_length - (bp) total length of the
+           matching contigs n50, l50 - N50 and L50 of the lengths of the
+           matching contigs) -> structure: parameter "query" of String,
+           parameter "num_found" of Long, parameter "columns" of mapping from
+           String to type "ColumnSummary" (count - number of contigs with a
+           known value of the column quantiles - values of the requested
+           quantiles (linear interpolation between the closest values)) ->
+           structure: parameter "count" of Long, parameter "sum" of Double,
+           parameter "min" of Double, parameter "max" of Double, parameter
+           "mean" of Double, parameter "quantiles" of list of Double,
+           parameter "histogram" of type "Histogram" (bin_edges - num_bins +
+           1 increasing bin edges, every bin includes its lower edge, the
+           last one also its upper edge counts - number of values within each
+           bin) -> structure: parameter "bin_edges" of list of Double,
+           parameter "counts" of list of Long, parameter "total_length" of
+           Long, parameter "n50" of Long, parameter "l50" of Long
+        """
+        # ctx is the context object
+        # return variables are: result
+        #BEGIN summarize_contigs
+        result = self.indexer.summarize_contigs(ctx["token"],
+                                                params.get("ref", None),
+                                                params.get("query", None),
+                                                params.get("filters", None),
+                                                params.get("columns", None),
+                                                params.get("num_bins", None),
+                                                params.get("quantiles", None))
+        #END summarize_contigs
+
+        # At some point might do deeper type checking...
+        if not isinstance(result, dict):
+            raise ValueError('Method summarize_contigs return value ' +
+                             'result is not type dict as required.')
+        # return the results
+        return [result]
+
+    def prewarm_indexes(self, ctx, params):
+        """
+        Build the search indexes of the assemblies (and their common sort
+        orders) in the background, ahead of the first search_contigs call.
+        Restricted to the admins of the service (prewarm-admins in deploy.cfg).
+        :param params: instance of type "IndexRefsParams" (refs - references
+           to assemblies or contig sets) -> structure: parameter "refs" of
+           list of String
+        :returns: instance of type "IndexStatusResult" -> structure:
+           parameter "statuses" of list of type "IndexStatus" (status - state
+           of the search index of the ref on this node, one of "queued",
+           "building", "ready", "failed", "rejected" (the prewarm queue was
+           full) or "not_indexed" error - error message of a failed build) ->
+           structure: parameter "ref" of String, parameter "status" of
+           String, parameter "error" of String
+        """
+        # ctx is the context object
+        # return variables are: result
+        #BEGIN prewarm_indexes
+        result = {"statuses": self.prewarmer.submit(params.get("refs") or [], ctx["token"],
+                                                    ctx["user_id"])}
+        #END prewarm_indexes
+
+        # At some point might do deeper type checking...
+        if not isinstance(result, dict):
+            raise ValueError('Method prewarm_indexes return value ' +
+                             'result is not type dict as required.')
+        # return the results
+        return [result]
+
+    def get_index_status(self, ctx, params):
+        """
+        Report whether the search indexes of the assemblies are ready.
+        :param params: instance of type "IndexRefsParams" (refs - references
+           to assemblies or contig sets) -> structure: parameter "refs" of
+           list of String
+        :returns: instance of type "IndexStatusResult" -> structure:
+           parameter "statuses" of list of type "IndexStatus" (status - state
+           of the search index of the ref on this node, one of "queued",
+           "building", "ready", "failed", "rejected" (the prewarm queue was
+           full) or "not_indexed" error - error message of a failed build) ->
+           structure: parameter "ref" of String, parameter "status" of
+           String, parameter "error" of String
+        """
+        # ctx is the context object
+        # return variables are: result
+        #BEGIN get_index_status
+        result = {"statuses": self.prewarmer.get_status(params.get("refs") or [],
+                                                        ctx["token"])}
+        #END get_index_status
+
+        # At some point might do deeper type checking...
+        if not isinstance(result, dict):
+            raise ValueError('Method get_index_status return value ' +
+                             'result is not type dict as required.')
+        # return the results
+        return [result]
+
     def get_assembly_id(self, ctx, ref):
         """
         Retrieve Assembly ID.
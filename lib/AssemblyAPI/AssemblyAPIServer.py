@@ -342,6 +342,18 @@ class Application(object):
                              name='AssemblyAPI.search_contigs',
                              types=[dict])
         self.method_authentication['AssemblyAPI.search_contigs'] = 'optional'  # noqa
+        self.rpc_service.add(impl_AssemblyAPI.summarize_contigs,
+                             name='AssemblyAPI.summarize_contigs',
+                             types=[dict])
+        self.method_authentication['AssemblyAPI.summarize_contigs'] = 'optional'  # noqa
+        self.rpc_service.add(impl_AssemblyAPI.prewarm_indexes,
+                             name='AssemblyAPI.prewarm_indexes',
+                             types=[dict])
+        self.method_authentication['AssemblyAPI.prewarm_indexes'] = 'required'  # noqa
+        self.rpc_service.add(impl_AssemblyAPI.get_index_status,
+                             name='AssemblyAPI.get_index_status',
+                             types=[dict])
+        self.method_authentication['AssemblyAPI.get_index_status'] = 'optional'  # noqa
         self.rpc_service.add(impl_AssemblyAPI.get_assembly_id,
                              name='AssemblyAPI.get_assembly_id',
                              types=[str])
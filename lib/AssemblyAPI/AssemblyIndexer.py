@@ -1,13 +1,44 @@
 # -*- coding: utf-8 -*-
+import base64
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import math
 import os
-import subprocess
-import tempfile
+import re
+import threading
 import time
-import traceback
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 
-from AssemblyAPI.CombinedLineIterator import CombinedLineIterator
+from AssemblyAPI.Codecs import get_codec
+from AssemblyAPI.ContigIndex import (NULL_INT, ContigIndex, ContigIndexWriter, load_row_array,
+                                     write_row_array)
+from AssemblyAPI.LRUCache import LRUCache
+from AssemblyAPI.ShardScan import ShardScanner, term_matches
+from AssemblyAPI.SingleFlight import FileLock, SingleFlight
+from AssemblyAPI.WorkspaceStream import iter_object_items
 from installed_clients.WorkspaceClient import Workspace as Workspace
 
+# a query term: optional "field:" followed by a quoted phrase or a word
+QUERY_TERM = re.compile(r'(?:(\w+):)?(?:"([^"]*)"?|([^\s,]+))')
+
+
+class _ReversedKey:
+    """Sorting key wrapper inverting the order of the wrapped value."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
 
 class AssemblyIndexer:
 
@@ -27,29 +58,334 @@ class AssemblyIndexer:
         self.assembly_index_dir = config["assembly-index-dir"]
         if not os.path.isdir(self.assembly_index_dir):
             os.makedirs(self.assembly_index_dir)
+        self.single_flight = SingleFlight(os.path.join(self.assembly_index_dir, "locks"))
         self.debug = "debug" in config and config["debug"] == "1"
-        self.max_sort_mem_size = 250000
+        # disk budget for assembly_index_dir, 0 means unlimited
+        self.max_index_dir_size = int(config.get("assembly-index-max-bytes", 0))
+        # estimated size of assembly_index_dir: its size as of its last scan plus the
+        # size of the files published by this process since, rescanned when it gets
+        # over budget or old
+        self.index_dir_size = None
+        self.index_dir_scan_time = 0
+        self.index_dir_scan_interval = 60
+        self.index_dir_lock = threading.Lock()
+        self.build_postings = config.get("assembly-index-postings", "1") == "1"
+        # indexes are memory-mapped unless they are compressed
+        self.index_codec = get_codec(config.get("assembly-index-codec", "none"))
         self.unicode_comma = "\uFF0C"
+        # (inner checksum, sort code, normalized query) -> array of matching rows
+        self.match_cache = LRUCache(int(config.get("search-cache-max-bytes", 64 * 1024 * 1024)),
+                                    lambda rows: rows.itemsize * len(rows))
+        # match sets of at least this many rows are also matched once per node and saved
+        # on disk
+        self.min_saved_matches = int(config.get("search-cache-min-saved-rows", 10000))
+        # inner checksum -> opened ContigIndex, (inner checksum, item type, sort code) ->
+        # array of sorted rows, (inner checksum, column, match cache key) -> array of
+        # sorted values, for the assemblies recently used by this worker
+        self.index_cache = LRUCache(int(config.get("index-cache-max-bytes", 1024 ** 3)),
+                                    lambda value: (value.nbytes if isinstance(value, ContigIndex)
+                                                   else value.itemsize * len(value)))
+        # inner checksum -> last time the index file was touched by this worker
+        self.index_touch_times = {}
+        self.index_touch_interval = 60
+        # indexes kept in memory are checked for eviction (by any process) at most
+        # every index_touch_interval seconds
+        self.index_check_time = 0
+        self.filter_columns = ["length", "gc", "N_count", "is_circ"]
+        # fields of "field:value" query terms
+        self.query_fields = ["contig_id", "description", "md5"]
+        self.summary_columns = ["length", "gc", "N_count"]
+        # number of assemblies opened and scanned in parallel by multi-ref searches
+        self.search_threads = int(config.get("search-threads", 8))
+        # all the assemblies of a multi-ref search are opened (and marked as used) at once
+        self.max_search_refs = int(config.get("search-max-refs", 20))
+        # sorted pages within this fraction of not yet sorted assemblies (of at least
+        # top_rows_min_index_size contigs) are selected without a full sort
+        self.top_rows_max_fraction = 0.1
+        self.top_rows_min_index_size = 10000
+        # the full sorts are run by a few threads, further ones are dropped while this
+        # many are pending (the next search of the assembly requests them again)
+        self.background_sorts = set()
+        self.max_background_sorts = int(config.get("sort-queue-size", 20))
+        self.sort_executor = ThreadPoolExecutor(max_workers=int(config.get("sort-threads", 2)))
+        # queries over at least this fraction of an assembly search the text of all of
+        # its contigs at once rather than contig by contig
+        self.search_scan_min_fraction = 0.05
+        # such scans of indexes of more than one shard are run by a pool of processes
+        self.index_shard_rows = int(config.get("assembly-index-shard-rows", 1000000))
+        self.shard_scanner = ShardScanner(int(config.get("scan-processes", 0)))
+        self.background_sorts_lock = threading.Lock()
+        self.sweep_temp_files()
 
-    def search_contigs(self, token, ref, query, sort_by, start, limit, num_found):
+    def search_contigs(self, token, ref, query, sort_by, start, limit, num_found, cursor=None,
+                       filters=None, refs=None):
         if query is None:
             query = ""
         if start is None:
             start = 0
         if limit is None:
             limit = 50
+        if refs:
+            return self.search_contigs_multi(token, refs, query, sort_by, start, limit, cursor,
+                                             filters)
+        sort_code = self.get_sorting_code(self.assembly_column_props_map, sort_by)
+        if self.debug:
+            print(f"Search: Assembly={ref}, query=[{query}], sort-by=[{sort_code}],"
+                  f" start={start}, limit={limit}")
+            t1 = time.time()
+        query_terms = self.get_query_terms(query)
+        range_filters = self.get_range_filters(filters)
+        with self.open_assembly_index(ref, token) as (inner_chsum, index):
+            if cursor:
+                start = self.decode_cursor(cursor, inner_chsum, sort_code, query,
+                                           range_filters)["start"]
+            page, num_found = self.get_search_page(inner_chsum, index, query_terms,
+                                                   range_filters, sort_by, start, limit)
+            contigs = [index.get_contig(row) for row in page]
+        ret = {"num_found": num_found, "start": start, "contigs": contigs, "query": query,
+               "cursor": None}
+        if start + len(contigs) < num_found:
+            ret["cursor"] = self.encode_cursor(inner_chsum, sort_code, query, range_filters,
+                                               start + len(contigs))
         if self.debug:
-            print(f"Search: Assembly={ref}, query=[{query}], "
-                  f"sort-by=[{self.get_sorting_code(self.assembly_column_props_map, sort_by)}],"
+            print(f"    (overall-time={time.time() - t1}, caches={self.get_cache_stats()})")
+        return ret
+
+    def search_contigs_multi(self, token, refs, query, sort_by, start, limit, cursor, filters):
+        """Search several assemblies at once: their indexes are built and scanned in
+        parallel and their matches are merged in sort_by order (ties keep the order of
+        refs). Contigs are tagged with their ref. The cursor keeps the number of matches
+        of each assembly consumed by the previous pages, so a page only merges limit
+        matches of each; without it the first start + limit ones are merged."""
+        if len(refs) > self.max_search_refs:
+            raise ValueError(f"At most {self.max_search_refs} refs can be searched at once")
+        sort_code = self.get_sorting_code(self.assembly_column_props_map, sort_by)
+        if self.debug:
+            print(f"Search: Assemblies={refs}, query=[{query}], sort-by=[{sort_code}],"
                   f" start={start}, limit={limit}")
             t1 = time.time()
-        inner_chsum = self.check_assembly_cache(ref, token)
-        index_iter = self.get_assembly_sorted_iterator(inner_chsum, sort_by)
-        ret = self.filter_contigs_query(index_iter, query, start, limit, num_found)
+        query_terms = self.get_query_terms(query)
+        range_filters = self.get_range_filters(filters)
+        with ExitStack() as stack, \
+                ThreadPoolExecutor(max_workers=self.search_threads) as executor:
+            # the indexes are closed by the stack once the executor is done with them
+            opened = list(executor.map(
+                lambda ref: stack.enter_context(self.open_assembly_index(ref, token)), refs))
+            inner_chsum = ",".join(chsum for chsum, _ in opened)
+            if cursor:
+                position = self.decode_cursor(cursor, inner_chsum, sort_code, query,
+                                              range_filters)
+                start = position["start"]
+                offsets = position.get("offsets")
+                if offsets is None or len(offsets) != len(refs):
+                    raise ValueError("Invalid search cursor: " + str(cursor))
+                skip = 0
+            else:
+                # the page is among the first start + limit matches of every assembly
+                offsets = [0] * len(refs)
+                skip = start
+            pages = list(executor.map(
+                lambda item: self.get_search_page(item[0][0], item[0][1], query_terms,
+                                                  range_filters, sort_by, item[1],
+                                                  skip + limit),
+                zip(opened, offsets)))
+            num_found = sum(count for _, count in pages)
+            sources = [self.iter_keyed_rows(pos, index, page, sort_by)
+                       for pos, ((_, index), (page, _)) in enumerate(zip(opened, pages))]
+            merged = heapq.merge(*sources, key=lambda item: item[0])
+            offsets = list(offsets)
+            for _, pos, _, _ in itertools.islice(merged, skip):
+                offsets[pos] += 1
+            contigs = []
+            for _, pos, index, row in itertools.islice(merged, limit):
+                offsets[pos] += 1
+                contig = index.get_contig(row)
+                contig["ref"] = refs[pos]
+                contigs.append(contig)
+        ret = {"num_found": num_found, "start": start, "contigs": contigs, "query": query,
+               "cursor": None}
+        if start + len(contigs) < num_found:
+            ret["cursor"] = self.encode_cursor(inner_chsum, sort_code, query, range_filters,
+                                               start + len(contigs), offsets)
+        if self.debug:
+            print(f"    (overall-time={time.time() - t1})")
+        return ret
+
+    def iter_keyed_rows(self, source, index, rows, sort_by):
+        key = self.get_row_key(index, sort_by, self.assembly_column_props_map)
+        for row in rows:
+            yield key(row), source, index, row
+
+    def get_search_page(self, inner_chsum, index, query_terms, range_filters, sort_by, start,
+                        limit):
+        """Rows of a page of search results in sort_by order and the number of all
+        matching rows."""
+        # num_found given by the client is not needed anymore: the whole match set of
+        # a query is cached, so later pages are just slices of it
+        matches = self.match_cache.get(
+            self.get_match_cache_key(inner_chsum, sort_by, query_terms, range_filters))
+        if matches is None:
+            candidates = self.get_query_candidates(index, query_terms, range_filters)
+            if candidates is None and self.is_top_rows_search(inner_chsum, index, sort_by,
+                                                              start + limit):
+                # first pages of a new sort order: select them without sorting the
+                # whole assembly and let the full sort run in the background
+                rows = self.match_cache.get(
+                    self.get_match_cache_key(inner_chsum, None, query_terms, range_filters))
+                if rows is None:
+                    rows = self.get_matching_rows(inner_chsum, index, query_terms,
+                                                  range_filters, None, None)
+                page = self.select_top_rows(index, rows, sort_by, start + limit,
+                                            self.assembly_column_props_map)[start:]
+                self.sort_in_background(inner_chsum, sort_by)
+                return page, len(rows)
+            matches = self.get_matching_rows(inner_chsum, index, query_terms,
+                                             range_filters, candidates, sort_by)
+        return matches[start:start + limit], len(matches)
+
+    def summarize_contigs(self, token, ref, query, filters, columns, num_bins, quantiles):
+        if query is None:
+            query = ""
+        if columns is None:
+            columns = self.summary_columns
+        if num_bins is None:
+            num_bins = 20
+        if quantiles is None:
+            quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+        for col_name in columns:
+            if col_name not in self.summary_columns:
+                raise ValueError("Unknown column name '" + col_name + "', " +
+                                 "please use one of " + str(self.summary_columns))
+        if not isinstance(num_bins, int) or num_bins < 1:
+            raise ValueError("num_bins should be a positive integer")
+        if not all(isinstance(q, (int, float)) and 0 <= q <= 1 for q in quantiles):
+            raise ValueError("quantiles should be numbers between 0 and 1")
+        if self.debug:
+            print(f"Summary: Assembly={ref}, query=[{query}], columns={columns}")
+            t1 = time.time()
+        query_terms = self.get_query_terms(query)
+        range_filters = self.get_range_filters(filters)
+        with self.open_assembly_index(ref, token) as (inner_chsum, index):
+            rows = rows_key = None
+            if query_terms or range_filters:
+                rows_key = self.get_match_cache_key(inner_chsum, None, query_terms,
+                                                    range_filters)
+                rows = self.match_cache.get(rows_key)
+                if rows is None:
+                    candidates = self.get_query_candidates(index, query_terms, range_filters)
+                    rows = self.get_matching_rows(inner_chsum, index, query_terms,
+                                                  range_filters, candidates, None)
+            num_found = len(index) if rows is None else len(rows)
+            ret = {"query": query, "num_found": num_found, "columns": {}}
+            lengths = None
+            for col_name in columns:
+                values = self.get_sorted_values(inner_chsum, index, col_name, rows, rows_key)
+                if col_name == "length":
+                    lengths = values
+                ret["columns"][col_name] = self.get_column_summary(values, num_bins, quantiles)
+            if lengths is None:
+                lengths = self.get_sorted_values(inner_chsum, index, "length", rows, rows_key)
+        ret.update(self.get_n50(lengths))
         if self.debug:
             print(f"    (overall-time={time.time() - t1})")
         return ret
 
+    def get_sorted_values(self, inner_chsum, index, col_name, rows=None, rows_key=None):
+        """Array of the sorted non-null values of a numeric column for the rows (all by
+        default), cached under rows_key (the match cache key of the rows)."""
+        cache_key = (inner_chsum, col_name, rows_key)
+        values = self.index_cache.get(cache_key)
+        if values is None:
+            values = array(index.sections[col_name].format,
+                           self.sort_values(index, col_name, rows))
+            self.index_cache.put(cache_key, values)
+        return values
+
+    def sort_values(self, index, col_name, rows):
+        column = index.sections[col_name]
+        order = index.sections.get(col_name + ".order")
+        if rows is None and order is not None:
+            # the non-null rows of the whole column are stored in value order
+            return list(map(column.__getitem__, order))
+        if rows is None:
+            values = column.tolist()
+        else:
+            values = list(map(column.__getitem__, rows))
+        if column.format == 'd':
+            # NaN (null) is the only value not equal to itself
+            values = [value for value in values if value == value]
+            values.sort()
+            return values
+        values.sort()
+        # nulls are the smallest values of the column
+        return values[bisect.bisect_right(values, NULL_INT):]
+
+    def get_column_summary(self, values, num_bins, quantiles):
+        """Summary statistics and histogram of sorted values."""
+        ret = {"count": len(values), "sum": None, "min": None, "max": None, "mean": None,
+               "quantiles": [None] * len(quantiles),
+               "histogram": {"bin_edges": [], "counts": []}}
+        if not values:
+            return ret
+        total = math.fsum(values) if isinstance(values[0], float) else sum(values)
+        ret.update({"sum": total, "min": values[0], "max": values[-1],
+                    "mean": total / len(values),
+                    "quantiles": [self.get_quantile(values, q) for q in quantiles]})
+        low, high = values[0], values[-1]
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        width = (high - low) / num_bins
+        edges = [low + width * pos for pos in range(num_bins)] + [high]
+        # values are sorted, so each bin is found by bisection instead of visiting
+        # every value
+        bounds = ([0] + [bisect.bisect_left(values, edge) for edge in edges[1:-1]] +
+                  [len(values)])
+        ret["histogram"] = {"bin_edges": edges,
+                            "counts": [bounds[pos + 1] - bounds[pos]
+                                       for pos in range(num_bins)]}
+        return ret
+
+    def get_quantile(self, values, q):
+        pos = (len(values) - 1) * q
+        low = math.floor(pos)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (pos - low)
+
+    def get_n50(self, lengths):
+        """N50 and L50 of sorted contig lengths."""
+        total_length = sum(lengths)
+        if not lengths:
+            return {"total_length": 0, "n50": None, "l50": None}
+        cumulative = list(itertools.accumulate(reversed(lengths)))
+        l50 = bisect.bisect_left(cumulative, total_length / 2) + 1
+        return {"total_length": total_length, "n50": lengths[-l50], "l50": l50}
+
+    def encode_cursor(self, inner_chsum, sort_code, query, range_filters, start,
+                      offsets=None):
+        """Cursor resuming a search at start (and, over several assemblies, at offsets in
+        the matches of each of them)."""
+        data = {"chsum": inner_chsum, "sort": sort_code, "query": query,
+                "filters": range_filters, "start": start}
+        if offsets is not None:
+            data["offsets"] = offsets
+        return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii")
+
+    def decode_cursor(self, cursor, inner_chsum, sort_code, query, range_filters):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            start = int(data["start"])
+            offsets = data.get("offsets")
+            if offsets is not None:
+                offsets = [int(offset) for offset in offsets]
+        except Exception:
+            raise ValueError("Invalid search cursor: " + str(cursor))
+        if (data.get("chsum") != inner_chsum or data.get("sort") != sort_code or
+                data.get("query") != query or
+                data.get("filters") != [list(f) for f in range_filters]):
+            raise ValueError("Search cursor doesn't match the ref, query, filters and "
+                             "sort_by of this search")
+        return {"start": start, "offsets": offsets}
+
     def to_text(self, mapping, key):
         if key not in mapping or mapping[key] is None:
             return ""
@@ -58,84 +394,239 @@ class AssemblyIndexer:
             return ",".join(str(x) for x in value if x)
         return str(value)
 
-    def save_assembly_tsv(self, contigs, inner_chsum):
-        outfile = tempfile.NamedTemporaryFile(dir=self.assembly_index_dir,
-                                              prefix=inner_chsum + self.ASSEMBLY_SUFFIX,
-                                              suffix=".tsv", delete=False)
-        with outfile:
+    @contextmanager
+    def open_assembly_index(self, ref, token, cache=True):
+        """Context giving (inner checksum, opened ContigIndex) for the assembly. Recently
+        used indexes are kept open in memory (unless cache is False). Either way the
+        index is marked as used (a shared lock) so it can't be evicted meanwhile."""
+        info = self.get_object_info(ref, token)
+        inner_chsum = info[8]
+        self.drop_deleted_indexes()
+        while True:
+            index = self.index_cache.get(inner_chsum) if cache else None
+            if index is not None and index.is_deleted():
+                self.index_cache.remove(inner_chsum)
+                index = None
+            if index is None:
+                self.check_assembly_cache(ref, token, info)
+            index_file = self.get_index_file(inner_chsum)
+            with FileLock(self.get_use_lock_file(inner_chsum), shared=True):
+                try:
+                    self.touch_index_file(inner_chsum)
+                    if index is None:
+                        index = ContigIndex(index_file, self.index_codec)
+                        cached = cache and self.index_cache.put(inner_chsum, index)
+                    else:
+                        cached = True
+                except FileNotFoundError:
+                    # evicted after the check, or while kept open in memory (shard scans
+                    # and background sorts open the file again): build it again
+                    self.index_cache.remove(inner_chsum)
+                    continue
+                if cached:
+                    yield inner_chsum, index
+                else:
+                    with index:
+                        yield inner_chsum, index
+                return
+
+    def drop_deleted_indexes(self):
+        """Drop the indexes kept in memory whose file was evicted meanwhile, so that
+        its disk space is freed once no request reads them anymore."""
+        now = time.time()
+        if now - self.index_check_time < self.index_touch_interval:
+            return
+        self.index_check_time = now
+        for key, value in self.index_cache.items():
+            if isinstance(value, ContigIndex) and value.is_deleted():
+                self.index_cache.remove(key)
+
+    def touch_index_file(self, inner_chsum):
+        """Mark the index as used now: its modification time is its last access time,
+        updated at most every index_touch_interval seconds. Raises FileNotFoundError
+        if the index was evicted."""
+        index_file = self.get_index_file(inner_chsum)
+        now = time.time()
+        if now - self.index_touch_times.get(inner_chsum, 0) < self.index_touch_interval:
+            os.stat(index_file)
+            return
+        os.utime(index_file)
+        self.index_touch_times[inner_chsum] = now
+
+    def get_cache_stats(self):
+        """Sizes and hit/miss/eviction counters of the in-memory caches of this worker."""
+        return {"index_cache": self.index_cache.get_stats(),
+                "match_cache": self.match_cache.get_stats()}
+
+    def get_use_lock_file(self, inner_chsum):
+        return self.single_flight.get_lock_file(inner_chsum + self.ASSEMBLY_SUFFIX + "_use")
+
+    def sweep_temp_files(self):
+        """Remove temporary files left behind by interrupted builds (together with
+        index files of the former gzipped TSV format)."""
+        for file_name in os.listdir(self.assembly_index_dir):
+            if not file_name.endswith((".tmp", ".tsv", ".tsv.gz")):
+                continue
+            inner_chsum = file_name.split("_", 1)[0]
+            build_lock = FileLock(self.single_flight.get_lock_file(
+                inner_chsum + self.ASSEMBLY_SUFFIX))
+            use_lock = FileLock(self.get_use_lock_file(inner_chsum))
+            if build_lock.acquire(blocking=False):
+                try:
+                    if use_lock.acquire(blocking=False):
+                        try:
+                            os.remove(os.path.join(self.assembly_index_dir, file_name))
+                        except FileNotFoundError:
+                            pass
+                        finally:
+                            use_lock.release()
+                finally:
+                    build_lock.release()
+
+    def evict_assembly_indexes(self, keep_chsum, added_size):
+        """Account for a file of added_size bytes just published in assembly_index_dir,
+        then, if it may be over its disk budget, delete least recently used assemblies
+        (their index and all derived files) until it fits. Assemblies being read and
+        the assembly keep_chsum are never deleted."""
+        if not self.max_index_dir_size:
+            return
+        with self.index_dir_lock:
+            if self.index_dir_size is not None:
+                self.index_dir_size += added_size
+                if (self.index_dir_size <= self.max_index_dir_size and time.time() -
+                        self.index_dir_scan_time < self.index_dir_scan_interval):
+                    return
+            self.index_dir_size = self.scan_assembly_indexes(keep_chsum)
+            self.index_dir_scan_time = time.time()
+
+    def scan_assembly_indexes(self, keep_chsum):
+        """Evict assemblies as needed (see evict_assembly_indexes) after summing up the
+        files of assembly_index_dir. Returns its size once done."""
+        groups = {}
+        total_size = 0
+        for entry in os.scandir(self.assembly_index_dir):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            inner_chsum = entry.name.split("_", 1)[0]
+            group = groups.setdefault(inner_chsum, {"files": [], "size": 0, "atime": 0})
+            group["files"].append(entry.path)
+            group["size"] += stat.st_size
+            group["atime"] = max(group["atime"], stat.st_mtime)
+            total_size += stat.st_size
+        for inner_chsum in sorted(groups, key=lambda chsum: groups[chsum]["atime"]):
+            if total_size <= self.max_index_dir_size:
+                break
+            if inner_chsum == keep_chsum:
+                continue
+            use_lock = FileLock(self.get_use_lock_file(inner_chsum))
+            if not use_lock.acquire(blocking=False):
+                continue
+            try:
+                if self.debug:
+                    print(f"    Evicting index of {inner_chsum}")
+                # the index itself goes first so readers never see derived files
+                # without it
+                index_file = self.get_index_file(inner_chsum)
+                for path in sorted(groups[inner_chsum]["files"],
+                                   key=lambda path: path != index_file):
+                    lock_file = self.single_flight.get_lock_file(os.path.basename(path))
+                    # lock files of derived files would pile up otherwise, at worst a
+                    # request still waiting on a removed one computes the file again
+                    for file_path in (path, lock_file) if path != index_file else (path,):
+                        try:
+                            os.remove(file_path)
+                        except FileNotFoundError:
+                            pass
+                total_size -= groups[inner_chsum]["size"]
+                self.index_cache.remove(inner_chsum)
+            finally:
+                use_lock.release()
+        return total_size
+
+    def get_index_file(self, inner_chsum):
+        return os.path.join(self.assembly_index_dir, inner_chsum + self.ASSEMBLY_SUFFIX + ".idx" +
+                            self.index_codec.suffix)
+
+    def save_assembly_index(self, contigs, inner_chsum):
+        with ContigIndexWriter(self.get_index_file(inner_chsum),
+                               trigrams=self.build_postings,
+                               codec=self.index_codec,
+                               shard_rows=self.index_shard_rows) as writer:
             for contig_data in contigs:
+                writer.add(self.to_text(contig_data, 'contig_id'),
+                           self.to_text(contig_data, 'description'),
+                           contig_data.get('length'),
+                           contig_data.get('gc_content'),
+                           contig_data.get('is_circ'),
+                           contig_data.get('Ncount'),
+                           self.to_text(contig_data, 'md5'))
+            writer.write()
 
-                contig_id = self.to_text(contig_data, 'contig_id')
-                description = self.to_text(contig_data, 'description')
-                length = ''
-                if 'length' in contig_data:
-                    length = str(contig_data['length'])
-                gc = ''
-                if 'gc_content' in contig_data:
-                    gc = str(contig_data['gc_content'])
-                is_circ = ''
-                if 'is_circ' in contig_data:
-                    is_circ = str(contig_data['is_circ'])
-                N_count = ''
-                if 'Ncount' in contig_data:
-                    N_count = str(contig_data['Ncount'])
-                md5 = self.to_text(contig_data, 'md5')
-
-                line = "\t".join(x for x in [contig_id, description, length, gc, is_circ, N_count,
-                                             md5]) + "\n"
-                outfile.write(line.encode("utf-8"))
-
-        subprocess.Popen(["gzip", outfile.name],
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE).wait()
-        os.rename(outfile.name + ".gz", os.path.join(self.assembly_index_dir,
-                                                     inner_chsum + self.ASSEMBLY_SUFFIX + ".tsv.gz"))
-
-    def check_assembly_cache(self, ref, token):
+    def get_object_info(self, ref, token):
         ws = Workspace(self.ws_url, token=token)
-        info = ws.get_object_info3({"objects": [{"ref": ref}]})['infos'][0]
+        return ws.get_object_info3({"objects": [{"ref": ref}]})['infos'][0]
+
+    def check_assembly_cache(self, ref, token, info):
         inner_chsum = info[8]
-        index_file = os.path.join(self.assembly_index_dir, inner_chsum + self.ASSEMBLY_SUFFIX + ".tsv.gz")
+        index_file = self.get_index_file(inner_chsum)
         if not os.path.isfile(index_file):
-            if self.debug:
-                print("    Loading WS object...")
-                t1 = time.time()
-
-            if 'KBaseGenomeAnnotations.Assembly' in info[2]:
-                included = ["/contigs"]
-                assembly_data = ws.get_objects2(
-                    {'objects': [{'ref': ref, 'included': included}]})['data'][0]['data']
-                contigs = list(assembly_data['contigs'].values())
-                self.save_assembly_tsv(contigs, inner_chsum)
-
-            elif 'KBaseGenomes.ContigSet' in info[2]:
-                included = ["/contigs/[*]/id",
-                            "/contigs/[*]/length",
-                            "/contigs/[*]/md5",
-                            "/contigs/[*]/description"]
-                cs_data = ws.get_objects2(
-                    {'objects': [{'ref': ref, 'included': included}]})['data'][0]['data']
-                contigs = []
-                for c in cs_data['contigs']:
-                    this_contig_data = {'contig_id': ''}
-                    if 'id' in c:
-                        this_contig_data['contig_id'] = c['id']
-                    if 'md5' in c:
-                        this_contig_data['md5'] = c['md5']
-                    if 'length' in c:
-                        this_contig_data['length'] = c['length']
-                    if 'description' in c:
-                        this_contig_data['description'] = c['description']
-                    contigs.append(this_contig_data)
-
-                self.save_assembly_tsv(contigs, inner_chsum)
-            else:
+            if ('KBaseGenomeAnnotations.Assembly' not in info[2] and
+                    'KBaseGenomes.ContigSet' not in info[2]):
                 raise ValueError('The "ref" is not an Assembly or ContigSet data object. '
                                  'It was a ' + info[2])
+            built = []
 
-            if self.debug:
-                print(f"    (time={time.time() - t1})")
+            def build():
+                self.build_assembly_index(token, ref, info)
+                built.append(os.path.getsize(index_file))
+
+            # concurrent requests for the same assembly wait for a single download
+            self.single_flight.run(inner_chsum + self.ASSEMBLY_SUFFIX,
+                                   lambda: os.path.isfile(index_file), build)
+            if built:
+                self.evict_assembly_indexes(inner_chsum, built[0])
         return inner_chsum
 
+    def build_assembly_index(self, token, ref, info):
+        inner_chsum = info[8]
+        if self.debug:
+            print("    Loading WS object...")
+            t1 = time.time()
+
+        # contigs are indexed while the Workspace response is being downloaded
+        if 'KBaseGenomeAnnotations.Assembly' in info[2]:
+            included = ["/contigs"]
+            contigs = iter_object_items(self.ws_url, token, ref, included, ["contigs"])
+            self.save_assembly_index(contigs, inner_chsum)
+
+        else:
+            included = ["/contigs/[*]/id",
+                        "/contigs/[*]/length",
+                        "/contigs/[*]/md5",
+                        "/contigs/[*]/description"]
+            cs_contigs = iter_object_items(self.ws_url, token, ref, included, ["contigs"])
+            self.save_assembly_index((self.convert_contig_set_item(c) for c in cs_contigs),
+                                     inner_chsum)
+
+        if self.debug:
+            print(f"    (time={time.time() - t1})")
+
+    def convert_contig_set_item(self, c):
+        this_contig_data = {'contig_id': ''}
+        if 'id' in c:
+            this_contig_data['contig_id'] = c['id']
+        if 'md5' in c:
+            this_contig_data['md5'] = c['md5']
+        if 'length' in c:
+            this_contig_data['length'] = c['length']
+        if 'description' in c:
+            this_contig_data['description'] = c['description']
+        return this_contig_data
+
     def get_column_props(self, column_props_map, col_name):
         if col_name not in column_props_map:
             raise ValueError("Unknown column name '" + col_name + "', " +
@@ -154,109 +645,320 @@ class AssemblyIndexer:
             ret += col_pos + ('a' if ascending_order else 'd')
         return ret
 
-    def get_assembly_sorted_iterator(self, inner_chsum, sort_by):
-        return self.get_sorted_iterator(inner_chsum, sort_by, self.ASSEMBLY_SUFFIX,
-                                        self.assembly_column_props_map)
+    def get_assembly_sorted_rows(self, inner_chsum, index, sort_by, cache=True):
+        return self.get_sorted_rows(inner_chsum, index, sort_by, self.ASSEMBLY_SUFFIX,
+                                    self.assembly_column_props_map, cache)
 
-    def get_sorted_iterator(self, inner_chsum, sort_by, item_type, column_props_map):
-        input_file = os.path.join(self.assembly_index_dir, inner_chsum + item_type + ".tsv.gz")
-        if not os.path.isfile(input_file):
-            raise ValueError("File not found: " + input_file)
-        if sort_by is None or len(sort_by) == 0:
-            return CombinedLineIterator(input_file)
-        cmd = "gunzip -c \"" + input_file + "\" | sort -f -t\\\t"
-        for column_sorting in sort_by:
-            col_name = column_sorting[0]
-            col_props = self.get_column_props(column_props_map, col_name)
-            col_pos = str(col_props["col"])
-            ascending_order = column_sorting[1]
-            sort_arg = "-k" + col_pos + "," + col_pos + col_props["type"]
-            if not ascending_order:
-                sort_arg += "r"
-            cmd += " " + sort_arg
+    def get_sorted_rows_file(self, inner_chsum, sort_by, item_type, column_props_map):
         fname = (inner_chsum + "_" + item_type + "_" +
                  self.get_sorting_code(column_props_map, sort_by))
-        final_output_file = os.path.join(self.assembly_index_dir, fname + ".tsv.gz")
-        if not os.path.isfile(final_output_file):
+        return os.path.join(self.assembly_index_dir, fname + ".rows" + self.index_codec.suffix)
+
+    def get_sorted_rows(self, inner_chsum, index, sort_by, item_type, column_props_map,
+                        cache=True):
+        """Array of the rows in sort_by order, kept in memory unless cache is False."""
+        if sort_by is None or len(sort_by) == 0:
+            return range(len(index))
+        cache_key = (inner_chsum, item_type, self.get_sorting_code(column_props_map, sort_by))
+        rows = self.index_cache.get(cache_key)
+        if rows is not None:
+            return rows
+
+        def sort():
             if self.debug:
                 print("    Sorting...")
                 t1 = time.time()
-            need_to_save = os.path.getsize(input_file) > self.max_sort_mem_size
-            if need_to_save:
-                outfile = tempfile.NamedTemporaryFile(dir=self.assembly_index_dir,
-                                                      prefix=fname + "_", suffix=".tsv.gz", delete=False)
-                outfile.close()
-                output_file = outfile.name
-                cmd += " | gzip -c > \"" + output_file + "\""
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            if not need_to_save:
-                if self.debug:
-                    print(f"    (time={time.time() - t1})")
-                return CombinedLineIterator(p)
+            rows = array('I', self.sort_rows(index, range(len(index)), sort_by,
+                                             column_props_map))
+            if self.debug:
+                print(f"    (time={time.time() - t1})")
+            return rows
+
+        rows = self.get_derived_rows(
+            inner_chsum, self.get_sorted_rows_file(inner_chsum, sort_by, item_type,
+                                                   column_props_map), sort)
+        if cache:
+            self.index_cache.put(cache_key, rows)
+        return rows
+
+    def get_derived_rows(self, inner_chsum, path, build, min_rows=0, get_cached=None):
+        """Array of rows derived from an assembly index (a sort order or a match set)
+        computed by build() at most once per node: concurrent requests of all the
+        processes wait for a single build, published atomically at path. Arrays of fewer
+        than min_rows rows are not published, get_cached() gives them (or None) once
+        built by another thread of this process."""
+        built = []
+
+        def publish():
+            rows = build()
+            if len(rows) >= min_rows:
+                write_row_array(path, rows, self.index_codec)
+            built.append(rows)
+
+        def is_done():
+            return os.path.isfile(path) or (get_cached is not None and
+                                            get_cached() is not None)
+
+        self.single_flight.run(os.path.basename(path), is_done, publish)
+        if built:
+            if len(built[0]) >= min_rows:
+                self.evict_assembly_indexes(inner_chsum, self.get_file_size(path))
+            return built[0]
+        rows = get_cached() if get_cached is not None else None
+        if rows is not None:
+            return rows
+        try:
+            return load_row_array(path, self.index_codec)
+        except FileNotFoundError:
+            # evicted right after it was published
+            return build()
+
+    def get_file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            # evicted right after it was published
+            return 0
+
+    def is_top_rows_search(self, inner_chsum, index, sort_by, top_count):
+        """Whether a page of a sorted search is better answered by selecting the first
+        top_count rows than by sorting the whole assembly (which isn't sorted yet)."""
+        if not sort_by or len(index) < self.top_rows_min_index_size:
+            return False
+        if top_count > len(index) * self.top_rows_max_fraction:
+            return False
+        if (inner_chsum, self.ASSEMBLY_SUFFIX,
+                self.get_sorting_code(self.assembly_column_props_map, sort_by)) in self.index_cache:
+            return False
+        return not os.path.isfile(self.get_sorted_rows_file(
+            inner_chsum, sort_by, self.ASSEMBLY_SUFFIX, self.assembly_column_props_map))
+
+    def select_top_rows(self, index, rows, sort_by, top_count, column_props_map):
+        """First top_count of the rows in the order sort_rows would give them."""
+        key = self.get_row_key(index, sort_by, column_props_map)
+        # the row itself breaks ties the same way the stable sorts do
+        return heapq.nsmallest(top_count, rows, key=lambda row: (key(row), row))
+
+    def get_row_key(self, index, sort_by, column_props_map):
+        """Key function of rows giving the order of sort_rows as a single key."""
+        keys = []
+        for col_name, ascending_order in sort_by or []:
+            col_props = self.get_column_props(column_props_map, col_name)
+            key = self.get_sorting_key(index, col_name, col_props)
+            if not ascending_order:
+                if col_props["type"] == "n":
+                    key = (lambda key: lambda row: -key(row))(key)
+                else:
+                    key = (lambda key: lambda row: _ReversedKey(key(row)))(key)
+            keys.append(key)
+        return lambda row: tuple(key(row) for key in keys)
+
+    def sort_in_background(self, inner_chsum, sort_by):
+        """Build the sort permutation of an assembly in a background thread."""
+        job = (inner_chsum, self.get_sorting_code(self.assembly_column_props_map, sort_by))
+        with self.background_sorts_lock:
+            if (job in self.background_sorts or
+                    len(self.background_sorts) >= self.max_background_sorts):
+                return
+            self.background_sorts.add(job)
+
+        def sort():
+            try:
+                with FileLock(self.get_use_lock_file(inner_chsum), shared=True):
+                    with ContigIndex(self.get_index_file(inner_chsum),
+                                     self.index_codec) as index:
+                        self.get_assembly_sorted_rows(inner_chsum, index, sort_by)
+            except FileNotFoundError:
+                # evicted meanwhile, nothing to sort
+                pass
+            finally:
+                with self.background_sorts_lock:
+                    self.background_sorts.discard(job)
+
+        self.sort_executor.submit(sort)
+
+    def sort_rows(self, index, rows, sort_by, column_props_map):
+        rows = list(rows)
+        # Stable sorts applied from the least to the most significant column give the
+        # same order as one multi-key sort (case-insensitive for text like "sort -f").
+        for column_sorting in reversed(sort_by):
+            col_name = column_sorting[0]
+            col_props = self.get_column_props(column_props_map, col_name)
+            ascending_order = column_sorting[1]
+            rows.sort(key=self.get_sorting_key(index, col_name, col_props),
+                      reverse=not ascending_order)
+        return rows
+
+    def get_sorting_key(self, index, col_name, col_props):
+        if col_props["type"] == "n":
+            # missing values are stored as the smallest value of the column (or NaN for
+            # floats) so they sort before any number
+            column = index.sections[col_name]
+            if column.format == 'd':
+                return lambda row: -math.inf if math.isnan(column[row]) else column[row]
+            return column.__getitem__
+        return lambda row: index.get_string(col_name, row).lower()
+
+    def get_query_terms(self, query):
+        """List of (field, lower-cased value, prefix) terms of a query. Words (and quoted
+        phrases) have no field and are looked for in contig ids and descriptions.
+        "field:value" terms match the whole contig_id or md5 (or its beginning with a
+        trailing "*") or text contained in the description."""
+        terms = []
+        for match in QUERY_TERM.finditer(str(query)):
+            field, quoted, value = match.groups()
+            if quoted is not None:
+                value = quoted
+            if field is not None and field not in self.query_fields:
+                # not a field, e.g. a colon in a contig id
+                field, value = None, match.group(0)
+            prefix = False
+            if field is not None and quoted is None and value.endswith("*"):
+                value = value[:-1]
+                prefix = field != "description"
+            if value:
+                terms.append((field, value.lower(), prefix))
+        return terms
+
+    def get_range_filters(self, filters):
+        """Sorted list of (column, min, max) from the "filters" search option."""
+        ret = []
+        if not filters:
+            return ret
+        for col_name, value in filters.items():
+            if col_name not in self.filter_columns:
+                raise ValueError("Unknown filter '" + col_name + "', " +
+                                 "please use one of " + str(self.filter_columns))
+            if value is None:
+                continue
+            if col_name == "is_circ":
+                if value not in (0, 1):
+                    raise ValueError("Filter 'is_circ' should be 0 or 1")
+                ret.append((col_name, value, value))
+                continue
+            if (not isinstance(value, dict) or not set(value).issubset({"min", "max"}) or
+                    not all(bound is None or isinstance(bound, (int, float))
+                            for bound in value.values())):
+                raise ValueError("Filter '" + col_name + "' should be a range with "
+                                 "optional numeric 'min' and 'max' values")
+            ret.append((col_name, value.get("min"), value.get("max")))
+        return sorted(ret)
+
+    def get_query_candidates(self, index, query_terms, range_filters):
+        """Rows (in index order) that may match all query terms according to the
+        indexes of the assembly and that match all range filters, or None if the search
+        has to be answered by a full scan."""
+        row_sets = [index.get_range_rows(col_name, min_value, max_value)
+                    for col_name, min_value, max_value in range_filters]
+        for term in query_terms:
+            rows = self.get_term_rows(index, term)
+            if rows is not None:
+                row_sets.append(rows)
+        if not row_sets:
+            return None
+        row_sets.sort(key=len)
+        candidates = set(row_sets[0])
+        for rows in row_sets[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(rows)
+        return sorted(candidates)
+
+    def get_term_rows(self, index, term):
+        """Rows that may match the query term according to the indexes of the assembly
+        (exactly the matching ones for keys), or None if they can't tell."""
+        field, value, prefix = term
+        if field is not None and index.has_key_rows(field):
+            return index.get_key_rows(field, value, prefix)
+        if field != "md5" and index.has_trigrams():
+            return index.get_trigram_rows(value)
+        return None
+
+    def get_match_cache_key(self, inner_chsum, sort_by, query_terms, range_filters):
+        return (inner_chsum, self.get_sorting_code(self.assembly_column_props_map, sort_by),
+                tuple(sorted(set(query_terms), key=str)), tuple(range_filters))
+
+    def get_matches_file(self, inner_chsum, sort_by, query_terms, range_filters):
+        query_key = json.dumps([sorted(set(query_terms), key=str), range_filters])
+        fname = (inner_chsum + "_" + self.ASSEMBLY_SUFFIX + "_" +
+                 self.get_sorting_code(self.assembly_column_props_map, sort_by) + "_" +
+                 hashlib.sha1(query_key.encode("utf-8")).hexdigest())
+        return os.path.join(self.assembly_index_dir, fname + ".matches" +
+                            self.index_codec.suffix)
+
+    def get_matching_rows(self, inner_chsum, index, query_terms, range_filters, candidates,
+                          sort_by):
+        """All rows matching the query terms and range filters in sort_by order, given
+        the candidate rows (see get_query_candidates). Match sets are cached in memory,
+        large ones on disk too."""
+        if not query_terms and not range_filters:
+            return self.get_assembly_sorted_rows(inner_chsum, index, sort_by)
+
+        def match():
+            if candidates is None:
+                rows = self.get_assembly_sorted_rows(inner_chsum, index, sort_by)
+            elif sort_by:
+                rows = self.sort_rows(index, candidates, sort_by,
+                                      self.assembly_column_props_map)
             else:
-                p.wait()
-                os.rename(output_file, final_output_file)
-                if self.debug:
-                    print(f"    (time={time.time() - t1})")
-        return CombinedLineIterator(final_output_file)
+                rows = candidates
+            if query_terms:
+                return self.filter_contigs_query(index, rows, query_terms)
+            return array('I', rows)
+
+        cache_key = self.get_match_cache_key(inner_chsum, sort_by, query_terms, range_filters)
+        num_candidates = len(index) if candidates is None else len(candidates)
+        if num_candidates < self.min_saved_matches:
+            # too few rows to be saved, cheap to match again
+            matches = match()
+        else:
+            matches = self.get_derived_rows(
+                inner_chsum, self.get_matches_file(inner_chsum, sort_by, query_terms,
+                                                   range_filters),
+                match, self.min_saved_matches, lambda: self.match_cache.get(cache_key))
+        self.match_cache.put(cache_key, matches)
+        return matches
 
-    def filter_contigs_query(self, index_iter, query, start, limit, num_found):
-        query_words = str(query).lower().translate(str.maketrans("\r\n\t,", "    ")).split()
+    def filter_contigs_query(self, index, rows, query_terms):
+        """Array of the rows (in the given order) matching all query terms."""
         if self.debug:
             print("    Filtering...")
             t1 = time.time()
-        fcount = 0
-        contigs = []
-        with index_iter:
-            for line in index_iter:
-                if all(word in line.lower() for word in query_words):
-                    if fcount >= start and fcount < start + limit:
-                        contigs.append(self.unpack_bin(line.rstrip('\n')))
-                    fcount += 1
-                    if num_found is not None and fcount >= start + limit:
-                        # Having shortcut when real num_found was already known
-                        fcount = num_found
-                        break
+        words = [value for field, value, _ in query_terms if field is None]
+        terms = [term for term in query_terms if term[0] is not None]
+        if (index.has_search_text() and self.shard_scanner.is_enabled(index) and
+                len(rows) >= len(index) * self.search_scan_min_fraction):
+            # large assembly: all the terms are matched shard by shard in parallel
+            matching_rows = set(self.shard_scanner.scan(index, self.index_codec, query_terms))
+            matches = array('I', filter(matching_rows.__contains__, rows))
+            words = terms = []
+        elif not words:
+            matches = rows
+        elif not index.has_search_text():
+            # index built before the search column was introduced
+            matches = array('I', (row for row in rows
+                                  if all(word in index.get_search_text(row)
+                                         for word in words)))
+        elif len(rows) < len(index) * self.search_scan_min_fraction:
+            words = [word.encode("utf-8") for word in words]
+            matches = array('I', (row for row in rows
+                                  if all(index.search_text_contains(row, word)
+                                         for word in words)))
+        else:
+            # most of the rows are to be checked: search the text of the whole assembly
+            # for each word instead
+            matching_rows = None
+            for word in words:
+                word_rows = index.get_search_rows(word.encode("utf-8"))
+                if matching_rows is None:
+                    matching_rows = set(word_rows)
+                else:
+                    matching_rows.intersection_update(word_rows)
+            matches = array('I', filter(matching_rows.__contains__, rows))
+        if terms:
+            matches = array('I', (row for row in matches
+                                  if all(term_matches(index, row, term)
+                                         for term in terms)))
         if self.debug:
-                print(f"    (time={time.time() - t1})")
-        return {"num_found": fcount, "start": start, "contigs": contigs,
-                "query": query}
-
-    def unpack_bin(self, line, items=None):
-        try:
-            if items is None:
-                items = line.split('\t')
-
-            contig_id = items[0]
-            description = items[1]
-
-            length = None
-            if items[2]:
-                length = int(items[2])
-
-            gc = None
-            if items[3]:
-                gc = float(items[3])
-
-            is_circ = None
-            if items[4]:
-                is_circ = int(items[4])
-
-            N_count = None
-            if items[5]:
-                N_count = int(items[5])
-
-            md5 = items[6]
-
-            return {'contig_id': contig_id,
-                    'description': description,
-                    'length': length,
-                    'gc': gc,
-                    'is_circ': is_circ,
-                    'N_count': N_count,
-                    'md5': md5
-                    }
-        except:
-            raise ValueError("Error parsing contig from: [" + line + "]\n" +
-                             "Cause: " + traceback.format_exc())
+            print(f"    (time={time.time() - t1})")
+        return matches
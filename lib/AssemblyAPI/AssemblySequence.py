@@ -1,4 +1,3 @@
-import gzip
 import json
 import logging
 import os
@@ -7,9 +6,15 @@ from collections import namedtuple
 
 import requests
 
+from AssemblyAPI.CacheManifest import CacheManifest
+from AssemblyAPI.Codecs import get_codec
+from AssemblyAPI.SequenceStore import (FORMATS, SUFFIX, SequenceFile, write_packed_sequence,
+                                       write_sequence)
+from AssemblyAPI.SingleFlight import FileLock, SingleFlight
 from installed_clients.WorkspaceClient import Workspace
 
 Location = namedtuple('location', ['contig', 'start', 'strand', 'length'])
+STAGING_SUFFIX = ".tmp"
 complements = str.maketrans({"G": "C", "C": "G", "A": "T", "T": "A"})
 
 
@@ -28,36 +33,34 @@ def _get_start(loc):
 def _extract_sequence(assembly_dir, feature_locs):
     """Given a cached assembly directory extract a sequence for each of the supplied locations"""
     contig = None
+    contig_id = None
     fragments = []
     for loc_tup in feature_locs:
         loc = Location(*loc_tup)
-        if not contig or loc.contig != os.path.basename(contig.name):
+        if not contig or loc.contig != contig_id:
+            if contig:
+                contig.close()
             try:
-                contig = gzip.open(os.path.join(assembly_dir, loc.contig))
+                contig = SequenceFile(os.path.join(assembly_dir, loc.contig + SUFFIX))
             except FileNotFoundError:
                 raise ValueError(f"{loc.contig} was not found in the cached assembly")
-        contig.seek(_get_start(loc))  # finally have a use for .seek()!
-        seq = contig.read(loc.length).decode().upper()
-        # seek and read won't complain if the parameter passed would result in a location not in
-        # the file so we need to make sure the sequence is the expected length
+            contig_id = loc.contig
+        # only the blocks of the contig overlapping the location are read
+        seq = contig.read(_get_start(loc), loc.length).decode().upper()
+        # read won't complain if the parameter passed would result in a location not in
+        # the contig so we need to make sure the sequence is the expected length
         if len(seq) != loc.length:
             raise ValueError(f'{loc} is not a valid location on this assembly')
         if loc.strand == '+':
             fragments.append(seq)
         if loc.strand == '-':
             fragments.append(seq.translate(complements)[::-1])  # reverse-complement for - strand
+    if contig:
+        contig.close()
     return "".join(fragments)
 
 
 class AssemblySequenceCache:
-    def _cull_cache(self):
-        """Ensure that cached assemblies do not proliferate"""
-        list_of_files = os.listdir(self.cache_dir)
-        while len(list_of_files) >= self.max_cached_objects:
-            oldest_file = min(list_of_files, key=lambda x: os.path.getctime(
-                os.path.join(self.cache_dir, x)))
-            shutil.rmtree(os.path.join(self.cache_dir, oldest_file))
-
     @staticmethod
     def _fasta_to_contigs(filepath):
         """Generator function to extract contigs sequences from a fasta file. Returns a tuple of
@@ -102,10 +105,22 @@ class AssemblySequenceCache:
 
     def _cache_assembly(self, ws, token, ref, assembly_dir):
         """Given a reference to an assembly or contig set pull the contigs out of Shock/WS and
-        cache in a directory of compressed sequences"""
+        cache in a directory of 2-bit packed (or block-compressed) sequences"""
         logging.info(f'Caching {ref}')
-        os.makedirs(assembly_dir)
-        self._cull_cache()
+        # filled in a staging directory renamed into place once complete, so a half-written
+        # assembly directory is never seen, not even after a crash
+        staging_dir = assembly_dir + STAGING_SUFFIX
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        try:
+            self._download_assembly(ws, token, ref, staging_dir)
+            os.rename(staging_dir, assembly_dir)
+        except:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+    def _download_assembly(self, ws, token, ref, assembly_dir):
+        """Write the sequences of each contig of the assembly into assembly_dir"""
         obj_data = ws.get_objects2(
             {'objects': [{'ref': ref, 'included': ['fasta_handle_info']}]})['data'][0]['data']
 
@@ -121,16 +136,43 @@ class AssemblySequenceCache:
             contigs = ((c['id'], c['sequence'].encode()) for c in contig_data)
 
         for cid, seq in contigs:
-            with gzip.open(os.path.join(assembly_dir, cid), 'wb', compresslevel=1) as outfile:
-                outfile.write(seq)
-
-    def __init__(self, ws_url, shock_url, max_cached_objects=100, cache_dir="./assembly_cache"):
+            path = os.path.join(assembly_dir, cid + SUFFIX)
+            if self.sequence_format == "packed":
+                write_packed_sequence(path, seq)
+            else:
+                write_sequence(path, seq, self.codec)
+
+    def __init__(self, ws_url, shock_url, max_cache_bytes=0, cache_dir="./assembly_cache",
+                 codec="gzip", sequence_format="packed"):
         self.ws_url = ws_url
         self.shock_url = shock_url
-        self.max_cached_objects = max_cached_objects
         self.cache_dir = cache_dir
+        # least recently used assemblies are evicted beyond max_cache_bytes (0: unlimited)
+        self.manifest = CacheManifest(cache_dir, max_cache_bytes)
+        # an assembly is downloaded by one request at a time, concurrent ones wait for it
+        self.single_flight = SingleFlight(os.path.join(self.manifest.lock_dir, "populate"))
+        self._sweep_staging_dirs()
+        # codec of the "blocks" format, "packed" sequences are not compressed any further
+        self.codec = get_codec(codec)
+        if sequence_format not in FORMATS:
+            raise ValueError(f"Unknown sequence cache format '{sequence_format}', "
+                             f"please use one of {FORMATS}")
+        self.sequence_format = sequence_format
         self.valid_types = {'KBaseGenomes.ContigSet', 'KBaseGenomeAnnotations.Assembly'}
 
+    def _sweep_staging_dirs(self):
+        """Remove staging directories left behind by interrupted downloads."""
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or not entry.name.endswith(STAGING_SUFFIX):
+                continue
+            key = entry.name.split(".", 1)[0]
+            build_lock = FileLock(self.single_flight.get_lock_file(key))
+            if build_lock.acquire(blocking=False):
+                try:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                finally:
+                    build_lock.release()
+
     def extract_dna_sequences(self, token, params):
         """Takes an assembly/contig set ref and one or more locations and returns the DNA sequence
         from the assembly at that location while caching the assembly for efficiency"""
@@ -140,10 +182,21 @@ class AssemblySequenceCache:
         locs = params.get('locations', [])
         ws = Workspace(self.ws_url, token=token)
         # This is also a cheap way to ensure that the object exists and that the user has access
-        obj_type = ws.get_object_info3({'objects': [{'ref': ref}]})['infos'][0][2]
+        info = ws.get_object_info3({'objects': [{'ref': ref}]})['infos'][0]
+        obj_type = info[2]
         if obj_type.split('-')[0] not in self.valid_types:
             raise ValueError(f'{obj_type} is not a valid input type for this function')
-        assembly_dir = os.path.join(self.cache_dir, ref.replace('/', ':'))
-        if not os.path.exists(assembly_dir):
-            self._cache_assembly(ws, token, ref, assembly_dir)
-        return [_extract_sequence(assembly_dir, l) for l in locs]
+        # cached by the checksum of the object, so an assembly is only cached once however
+        # it is referenced (by version, name or through a genome)
+        assembly_dir = self.manifest.get_entry_dir(info[8])
+        # not evicted while its sequences are read
+        with self.manifest.pin(info[8]):
+            if not os.path.exists(assembly_dir):
+                def populate():
+                    self._cache_assembly(ws, token, ref, assembly_dir)
+                    self.manifest.add(info[8])
+
+                self.single_flight.run(info[8], lambda: os.path.exists(assembly_dir), populate)
+            else:
+                self.manifest.touch(info[8])
+            return [_extract_sequence(assembly_dir, l) for l in locs]
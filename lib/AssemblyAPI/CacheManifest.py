@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from AssemblyAPI.SingleFlight import FileLock
+
+MANIFEST_FILE = "manifest.log"
+LOCK_DIR = "locks"
+# last access times are only written to the manifest when they change by more than
+# this many seconds
+ACCESS_RESOLUTION = 60
+# the manifest is compacted (and the heap rebuilt) once it holds more than this many
+# records per entry, plus MIN_RECORDS
+RECORDS_PER_ENTRY = 2
+MIN_RECORDS = 1000
+
+
+class CacheManifest:
+    """Least recently used eviction of the entries (directories) of a cache directory
+    bounded by their total size in bytes. The size and last access time of each entry
+    are kept in a manifest file shared by the processes of this node, so evicting does
+    not walk the cache directory. Entries pinned by a request (of any process) are never
+    evicted while it reads them.
+
+    The manifest is a log of [key, size, last access time] records (size null for a
+    removed entry) after a line identifying the file. Changes are appended to it and
+    each process reads only the records added since it last looked, into a heap of the
+    entries by last access time and their total size, so recording an entry costs
+    O(log n) however many entries the cache holds. The log is rewritten from the
+    entries once it is mostly made of outdated records."""
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        # 0 means unlimited
+        self.max_bytes = max_bytes
+        self.path = os.path.join(cache_dir, MANIFEST_FILE)
+        self.lock_dir = os.path.join(cache_dir, LOCK_DIR)
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # key -> [size in bytes, last access time], as of _offset in the manifest file
+        # identified by _file_id
+        self._entries = {}
+        # (last access time, key) of each entry, along with outdated items
+        self._heap = []
+        self._total_size = 0
+        self._file_id = None
+        self._offset = 0
+        self._num_records = 0
+        self._changes = []
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _get_lock_file(self, key):
+        return os.path.join(self.lock_dir, key + ".lock")
+
+    @contextmanager
+    def pin(self, key):
+        """Protect the entry from eviction until the end of the block."""
+        with FileLock(self._get_lock_file(key), shared=True):
+            yield
+
+    @contextmanager
+    def _locked(self):
+        """Up-to-date entries for the block, whose changes (see _set) are written to the
+        manifest at its end. Blocks other processes updating the manifest meanwhile."""
+        with self._lock, FileLock(self.path + ".lock"):
+            self._changes = []
+            self._load()
+            try:
+                yield
+            finally:
+                self._save()
+
+    def _load(self):
+        try:
+            infile = open(self.path, "rb")
+        except FileNotFoundError:
+            # cache directory without a manifest yet (as left by an older version of
+            # the service)
+            self._reset()
+            for key, (size, access_time) in self._scan().items():
+                self._apply(key, size, access_time)
+            return
+        with infile:
+            file_id = infile.readline()
+            if not file_id.endswith(b"\n"):
+                # truncated, rewritten from scratch
+                self._reset()
+                return
+            if file_id != self._file_id:
+                # rewritten by another process
+                self._reset()
+                self._file_id = file_id
+                self._offset = len(file_id)
+            infile.seek(self._offset)
+            data = infile.read()
+        # complete records only
+        data = data[:data.rfind(b"\n") + 1]
+        records = data.splitlines()
+        for record in records:
+            self._apply(*json.loads(record))
+        self._offset += len(data)
+        self._num_records += len(records)
+
+    def _save(self):
+        if (self._file_id is None or
+                self._num_records > RECORDS_PER_ENTRY * len(self._entries) + MIN_RECORDS):
+            self._compact()
+        elif self._changes:
+            data = "".join(json.dumps(change) + "\n" for change in self._changes)
+            data = data.encode("utf-8")
+            with open(self.path, "r+b") as outfile:
+                # over a record cut short by a crash, if any
+                outfile.seek(self._offset)
+                outfile.write(data)
+                outfile.truncate()
+            self._offset += len(data)
+            self._num_records += len(self._changes)
+        self._changes = []
+
+    def _compact(self):
+        self._file_id = (uuid.uuid4().hex + "\n").encode("utf-8")
+        data = self._file_id + "".join(
+            json.dumps([key, size, access_time]) + "\n"
+            for key, (size, access_time) in self._entries.items()).encode("utf-8")
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_path, self.path)
+        self._offset = len(data)
+        self._num_records = len(self._entries)
+        self._heap = [(access_time, key) for key, (_, access_time) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def _apply(self, key, size, access_time):
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self._total_size -= old_entry[0]
+        if size is not None:
+            self._entries[key] = [size, access_time]
+            self._total_size += size
+            heapq.heappush(self._heap, (access_time, key))
+
+    def _set(self, key, size, access_time):
+        """Record a change of the entry (a size of None removes it)."""
+        self._apply(key, size, access_time)
+        self._changes.append([key, size, access_time])
+
+    def _scan(self):
+        entries = {}
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.name != LOCK_DIR and not entry.name.endswith(".tmp"):
+                entries[entry.name] = [_get_dir_size(entry.path), entry.stat().st_mtime]
+        return entries
+
+    def touch(self, key):
+        """Record an access to the entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < ACCESS_RESOLUTION:
+            return
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._set(key, entry[0], now)
+
+    def add(self, key):
+        """Record the new entry (once its directory is complete), then evict least
+        recently used entries until the cache fits into its budget."""
+        size = _get_dir_size(self.get_entry_dir(key))
+        with self._locked():
+            self._set(key, size, time.time())
+            self._evict(key)
+
+    def _evict(self, keep_key):
+        if not self.max_bytes:
+            return
+        skipped = []
+        while self._heap and self._total_size > self.max_bytes:
+            access_time, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != access_time:
+                # outdated
+                continue
+            if key == keep_key or not self._remove_entry_dir(key):
+                skipped.append((access_time, key))
+                continue
+            self._set(key, None, None)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+
+    def _remove_entry_dir(self, key):
+        """Delete the directory of the entry unless it is pinned. Returns whether it
+        was deleted."""
+        use_lock = FileLock(self._get_lock_file(key))
+        if not use_lock.acquire(blocking=False):
+            return False
+        try:
+            entry_dir = self.get_entry_dir(key)
+            # renamed first so the entry disappears at once
+            tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+            try:
+                os.rename(entry_dir, tmp_dir)
+            except FileNotFoundError:
+                pass
+            else:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            return True
+        finally:
+            use_lock.release()
+
+
+def _get_dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return size
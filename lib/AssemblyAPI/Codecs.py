@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import gzip
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class Codec:
+    """Compression format of cache files: a name (as used in deploy.cfg), the suffix of
+    the file names, a function opening a file for binary reading or writing and the
+    functions (de)compressing a block of bytes on its own."""
+
+    def __init__(self, name, suffix, opener, compress, decompress):
+        self.name = name
+        self.suffix = suffix
+        self._opener = opener
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return f"Codec({self.name})"
+
+    def open(self, path, mode="rb"):
+        return self._opener(path, mode)
+
+    def is_compressed(self):
+        return self.name != "none"
+
+
+CODECS = {
+    "none": Codec("none", "", open, bytes, bytes),
+    "gzip": Codec("gzip", ".gz", lambda path, mode: gzip.open(path, mode, compresslevel=1),
+                  lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+if lz4 is not None:
+    CODECS["lz4"] = Codec("lz4", ".lz4", lambda path, mode: lz4.frame.open(path, mode),
+                          lz4.frame.compress, lz4.frame.decompress)
+
+
+def get_codec(name):
+    if name not in CODECS:
+        if name == "lz4":
+            raise ValueError("Codec 'lz4' requires the lz4 package to be installed")
+        raise ValueError("Unknown codec '" + str(name) + "', " +
+                         "please use one of " + str(list(CODECS)))
+    return CODECS[name]
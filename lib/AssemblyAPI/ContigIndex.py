@@ -0,0 +1,687 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import heapq
+import math
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+
+# Binary columnar layout of an assembly contig index:
+#
+#   MAGIC (8 bytes) | header length (uint64) | JSON header (padded to 8 bytes) | sections
+#
+# The JSON header stores the number of rows and, for each named section, its offset
+# (relative to the end of the header), its size in bytes and its array typecode.
+# Numeric columns are fixed-width arrays (one value per row), string columns are
+# stored as a "<name>.offsets" array of num_rows + 1 positions into a "<name>.data"
+# UTF-8 blob. The lower-cased contig_id and description of each row, joined by a tab
+# and followed by a newline, are also stored as a "search" string column so queries
+# can be matched without decoding or case folding anything per row. Every section
+# is 8-byte aligned so it can be cast in place from a memory map without copying
+# or decoding. The rows are split into shards of "shard_rows" consecutive rows (as
+# recorded in the header), the units of the scans run in parallel over large indexes.
+MAGIC = b"KBASMIDX"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+SHARD_ROWS = 1000000
+
+NULL_INT = -(2 ** 63)
+NULL_CIRC = -1
+
+COLUMNS = ["contig_id", "description", "length", "gc", "is_circ", "N_count", "md5"]
+STRING_COLUMNS = ["contig_id", "description", "md5"]
+NUMERIC_COLUMNS = {"length": "q", "gc": "d", "is_circ": "b", "N_count": "q"}
+# columns covered by queries: by the "search" column and the optional trigram
+# postings ("trigrams.*" sections)
+TRIGRAM_COLUMNS = ["contig_id", "description"]
+SEARCH_COLUMN = "search"
+# numeric columns with a "<name>.order" section: the non-null rows sorted by value
+RANGE_COLUMNS = ["length", "gc", "is_circ", "N_count"]
+# string columns with a "<name>.sorted" section: the rows sorted by lower-cased value
+KEY_COLUMNS = ["contig_id", "md5"]
+# string columns with a "<name>.hash" section: an open addressing hash table (linear
+# probing, crc32 of the lower-cased value) of row + 1 per slot, 0 for empty slots
+HASH_COLUMNS = ["contig_id"]
+
+
+# number of values buffered in memory per column before they are spooled to disk
+SPOOL_BUFFER_ITEMS = 8192
+# number of records sorted in memory at once by a _SortSpool (the length of its runs),
+# records and bytes (of their bytes fields) per block of a run, and runs merged at once
+SORT_BUFFER_ITEMS = 100000
+SORT_BLOCK_ITEMS = 1024
+SORT_BLOCK_BYTES = 64 * 1024
+SORT_MAX_RUNS = 64
+# number of trigram postings kept in memory before they are spooled to disk, and
+# number of rows per spooled record
+POSTINGS_BUFFER_ITEMS = 1000000
+POSTINGS_RECORD_ROWS = 4096
+
+
+def _padding(size):
+    return (ALIGNMENT - size % ALIGNMENT) % ALIGNMENT
+
+
+def get_trigrams(text):
+    """Set of 3-byte substrings of UTF-8 encoded text, each packed into an int."""
+    return {int.from_bytes(text[pos:pos + 3], "big") for pos in range(len(text) - 2)}
+
+
+def is_null(column, value):
+    if column == "gc":
+        return math.isnan(value)
+    if column == "is_circ":
+        return value == NULL_CIRC
+    return value == NULL_INT
+
+
+def get_key(text):
+    """Sorting key of a string value in the "<name>.sorted" sections."""
+    return text.lower().encode("utf-8")
+
+
+def _write_hash_table(spool, keys, num_keys, directory):
+    """Write the hash table of the keys (of rows 0 to num_keys - 1) to the spool. The rows
+    are placed in the order of their home slots (externally sorted), so the table is
+    written sequentially: a row goes to the first free slot from its home slot, like
+    with linear probing, and rows running past the last slot wrap around to the first
+    free slots of the table."""
+    size = 1
+    while size < 2 * num_keys:
+        size *= 2
+    mask = size - 1
+    homes = _SortSpool(directory)
+    try:
+        for row, key in enumerate(keys):
+            homes.append((zlib.crc32(key) & mask, row))
+        next_slot = 0
+        wrapped_rows = []
+        for home, row in homes:
+            if max(home, next_slot) >= size:
+                wrapped_rows.append(row)
+                continue
+            if home > next_slot:
+                spool.write(bytes(4 * (home - next_slot)))
+                next_slot = home
+            spool.append(row + 1)
+            next_slot += 1
+    finally:
+        homes.close()
+    spool.write(bytes(4 * (size - next_slot)))
+    spool.file.flush()
+    fd = spool.file.fileno()
+    slot = 0
+    for row in wrapped_rows:
+        while os.pread(fd, 4, 4 * slot) != bytes(4):
+            slot += 1
+        os.pwrite(fd, array('I', [row + 1]).tobytes(), 4 * slot)
+
+
+def _bisect_values(order, values, value, right=False):
+    """bisect over the rows in order, comparing their values (values[row])."""
+    low, high = 0, len(order)
+    while low < high:
+        middle = (low + high) // 2
+        if values[order[middle]] < value or (right and values[order[middle]] == value):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _open_temp_file(path, codec):
+    """Temporary file next to path, opened for writing through the codec, and its path."""
+    tmp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                           prefix=os.path.basename(path) + "_",
+                                           suffix=".tmp", delete=False)
+    if codec is None or not codec.is_compressed():
+        return tmp_file, tmp_file.name
+    tmp_file.close()
+    try:
+        return codec.open(tmp_file.name, "wb"), tmp_file.name
+    except:
+        os.remove(tmp_file.name)
+        raise
+
+
+def write_row_array(path, rows, codec=None):
+    """Atomically save an array('I') of row numbers (e.g. a sort permutation)."""
+    outfile, tmp_path = _open_temp_file(path, codec)
+    try:
+        with outfile:
+            outfile.write(rows.tobytes())
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def load_row_array(path, codec=None):
+    rows = array('I')
+    with open(path, "rb") if codec is None else codec.open(path, "rb") as infile:
+        rows.frombytes(infile.read())
+    return rows
+
+
+class _RowKeys:
+    """Sorting keys of the rows of a string column, computed on access."""
+
+    def __init__(self, index, column):
+        self.index = index
+        self.column = column
+
+    def __getitem__(self, row):
+        return get_key(self.index.get_string(self.column, row))
+
+
+class _SectionSpool:
+    """Content of one section accumulated in an anonymous temporary file, so that
+    memory use while writing an index doesn't grow with the number of contigs."""
+
+    def __init__(self, directory, typecode):
+        self.typecode = typecode
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.buffer = array(typecode)
+        self.size = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= SPOOL_BUFFER_ITEMS:
+            self.flush()
+
+    def write(self, data):
+        self.flush()
+        self.file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        if self.buffer:
+            data = self.buffer.tobytes()
+            self.buffer = array(self.typecode)
+            self.write(data)
+
+    def read_bytes(self):
+        self.flush()
+        self.file.seek(0)
+        return self.file.read()
+
+    def iter_values(self):
+        """Values of the spool, read back SPOOL_BUFFER_ITEMS at a time."""
+        self.flush()
+        self.file.seek(0)
+        block_size = SPOOL_BUFFER_ITEMS * array(self.typecode).itemsize
+        while True:
+            values = array(self.typecode)
+            values.frombytes(self.file.read(block_size))
+            if not values:
+                return
+            yield from values
+
+    def iter_strings(self, data):
+        """Values of a string column, this spool being its offsets and data its data."""
+        data.flush()
+        data.file.seek(0)
+        offsets = self.iter_values()
+        start = next(offsets)
+        for end in offsets:
+            yield data.file.read(end - start)
+            start = end
+
+    def copy_to(self, outfile):
+        self.flush()
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, outfile)
+
+    def close(self):
+        self.file.close()
+
+
+class _SortSpool:
+    """Records (comparable tuples) sorted with a bounded amount of memory: runs of up to
+    SORT_BUFFER_ITEMS records are sorted in memory and spooled to an anonymous temporary
+    file as pickled blocks, then merged when the records are read back in order."""
+
+    def __init__(self, directory):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.buffer = []
+        # (start, end) positions of the runs in the file
+        self.runs = []
+        self.size = 0
+
+    def append(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= SORT_BUFFER_ITEMS:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.sort()
+            self.add_run(self.buffer)
+            self.buffer = []
+
+    def add_run(self, records):
+        """Spool already sorted records as a run."""
+        start = self.size
+        block = []
+        block_bytes = 0
+        for record in records:
+            block.append(record)
+            block_bytes += sum(len(field) for field in record if isinstance(field, bytes))
+            if len(block) == SORT_BLOCK_ITEMS or block_bytes >= SORT_BLOCK_BYTES:
+                self._write_block(block)
+                block = []
+                block_bytes = 0
+        self._write_block(block)
+        self.runs.append((start, self.size))
+
+    def _write_block(self, block):
+        if block:
+            data = pickle.dumps(block, pickle.HIGHEST_PROTOCOL)
+            self.file.write(struct.pack("<Q", len(data)) + data)
+            self.size += 8 + len(data)
+
+    def _read_run(self, start, end):
+        fd = self.file.fileno()
+        while start < end:
+            length = struct.unpack("<Q", os.pread(fd, 8, start))[0]
+            yield from pickle.loads(os.pread(fd, length, start + 8))
+            start += 8 + length
+
+    def __iter__(self):
+        """All records in order."""
+        self.flush()
+        self.file.flush()
+        # runs are merged SORT_MAX_RUNS at a time into longer runs until few are left
+        while len(self.runs) > SORT_MAX_RUNS:
+            runs, self.runs = self.runs[:SORT_MAX_RUNS], self.runs[SORT_MAX_RUNS:]
+            self.add_run(heapq.merge(*(self._read_run(*run) for run in runs)))
+            self.file.flush()
+        return heapq.merge(*(self._read_run(*run) for run in self.runs))
+
+    def close(self):
+        self.file.close()
+
+
+class ContigIndexWriter:
+    """Writes contigs, as they are added, column by column into temporary spool files
+    which are assembled into a ContigIndex file at path by write(). The optional trigram
+    postings and the sorted sections are built with bounded buffers spooled to disk too,
+    so memory use doesn't grow with the number of contigs. The file is compressed with
+    the codec, if any is given."""
+
+    def __init__(self, path, trigrams=False, codec=None, shard_rows=SHARD_ROWS):
+        self.path = path
+        self.codec = codec
+        self.shard_rows = shard_rows
+        self.num_rows = 0
+        directory = os.path.dirname(path)
+        self.directory = directory
+        # trigram -> array of rows of the postings not spooled yet, and postings spooled
+        # as (trigram, number of the run, part, bytes of an array of rows) records
+        self.trigrams = {} if trigrams else None
+        self.num_buffered_postings = 0
+        self.postings = _SortSpool(directory) if trigrams else None
+        self.spools = {}
+        for name in STRING_COLUMNS + [SEARCH_COLUMN]:
+            self.spools[name + ".offsets"] = _SectionSpool(directory, 'Q')
+            self.spools[name + ".offsets"].append(0)
+            self.spools[name + ".data"] = _SectionSpool(directory, 'B')
+        for name, code in NUMERIC_COLUMNS.items():
+            self.spools[name] = _SectionSpool(directory, code)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for spool in self.spools.values():
+            spool.close()
+        if self.postings is not None:
+            self.postings.close()
+
+    def add(self, contig_id, description, length, gc, is_circ, N_count, md5):
+        for name, value in (("contig_id", contig_id), ("description", description),
+                            ("md5", md5)):
+            data = self.spools[name + ".data"]
+            data.write(value.encode("utf-8"))
+            self.spools[name + ".offsets"].append(data.size)
+        self.spools["length"].append(NULL_INT if length is None else int(length))
+        self.spools["gc"].append(math.nan if gc is None else float(gc))
+        self.spools["is_circ"].append(NULL_CIRC if is_circ is None else int(is_circ))
+        self.spools["N_count"].append(NULL_INT if N_count is None else int(N_count))
+        search_values = [value.lower().encode("utf-8") for value in (contig_id, description)]
+        data = self.spools[SEARCH_COLUMN + ".data"]
+        data.write(b"\t".join(search_values) + b"\n")
+        self.spools[SEARCH_COLUMN + ".offsets"].append(data.size)
+        if self.trigrams is not None:
+            row_trigrams = set()
+            for value in search_values:
+                row_trigrams |= get_trigrams(value)
+            for trigram in row_trigrams:
+                postings = self.trigrams.get(trigram)
+                if postings is None:
+                    postings = self.trigrams[trigram] = array('I')
+                postings.append(self.num_rows)
+            self.num_buffered_postings += len(row_trigrams)
+            if self.num_buffered_postings >= POSTINGS_BUFFER_ITEMS:
+                self.flush_postings()
+        self.num_rows += 1
+
+    def flush_postings(self):
+        run = len(self.postings.runs)
+        self.postings.add_run(
+            (trigram, run, start, self.trigrams[trigram][start:start + POSTINGS_RECORD_ROWS]
+             .tobytes())
+            for trigram in sorted(self.trigrams)
+            for start in range(0, len(self.trigrams[trigram]), POSTINGS_RECORD_ROWS))
+        self.trigrams = {}
+        self.num_buffered_postings = 0
+
+    def new_spool(self, name, typecode):
+        spool = self.spools[name] = _SectionSpool(self.directory, typecode)
+        return spool
+
+    def get_sorted_rows(self, name, records):
+        """Spool of the rows of the (value, row) records sorted by value."""
+        sort_spool = _SortSpool(self.directory)
+        try:
+            for record in records:
+                sort_spool.append(record)
+            rows = self.new_spool(name, 'I')
+            for _, row in sort_spool:
+                rows.append(row)
+        finally:
+            sort_spool.close()
+        return rows
+
+    def iter_keys(self, column):
+        for value in self.spools[column + ".offsets"].iter_strings(
+                self.spools[column + ".data"]):
+            yield get_key(str(value, "utf-8"))
+
+    def get_sections(self):
+        """List of (name, typecode, spool) in file order."""
+        sections = []
+        for name in STRING_COLUMNS + [SEARCH_COLUMN]:
+            for section in (name + ".offsets", name + ".data"):
+                sections.append((section, self.spools[section].typecode, self.spools[section]))
+        for name in NUMERIC_COLUMNS:
+            sections.append((name, self.spools[name].typecode, self.spools[name]))
+        for name in RANGE_COLUMNS:
+            order = self.get_sorted_rows(
+                name + ".order", ((value, row) for row, value in enumerate(
+                    self.spools[name].iter_values()) if not is_null(name, value)))
+            sections.append((name + ".order", 'I', order))
+        for name in KEY_COLUMNS:
+            order = self.get_sorted_rows(
+                name + ".sorted", ((key, row) for row, key in enumerate(self.iter_keys(name))))
+            sections.append((name + ".sorted", 'I', order))
+            if name in HASH_COLUMNS:
+                table = self.new_spool(name + ".hash", 'I')
+                _write_hash_table(table, self.iter_keys(name), self.num_rows, self.directory)
+                sections.append((name + ".hash", 'I', table))
+        if self.trigrams is not None:
+            self.flush_postings()
+            keys = self.new_spool("trigrams.keys", 'I')
+            offsets = self.new_spool("trigrams.offsets", 'Q')
+            rows = self.new_spool("trigrams.rows", 'I')
+            offsets.append(0)
+            last_trigram = None
+            # the runs follow the order of the rows, so the parts of the postings of a
+            # trigram are concatenated in that order
+            for trigram, _, _, trigram_rows in self.postings:
+                if trigram != last_trigram:
+                    if last_trigram is not None:
+                        offsets.append(rows.size // 4)
+                    keys.append(trigram)
+                    last_trigram = trigram
+                rows.write(trigram_rows)
+            if last_trigram is not None:
+                offsets.append(rows.size // 4)
+            sections.append(("trigrams.keys", 'I', keys))
+            sections.append(("trigrams.offsets", 'Q', offsets))
+            sections.append(("trigrams.rows", 'I', rows))
+        return sections
+
+    def write(self):
+        """Write the index atomically: the file appears under its final name only
+        once it is complete."""
+        sections = self.get_sections()
+        header = {"version": FORMAT_VERSION, "byteorder": sys.byteorder,
+                  "num_rows": self.num_rows, "shard_rows": self.shard_rows, "sections": {}}
+        offset = 0
+        for name, code, data in sections:
+            if isinstance(data, _SectionSpool):
+                data.flush()
+            size = data.size if isinstance(data, _SectionSpool) else len(data)
+            header["sections"][name] = [offset, size, code]
+            offset += size + _padding(size)
+        header_data = json.dumps(header).encode("utf-8")
+        outfile, tmp_path = _open_temp_file(self.path, self.codec)
+        try:
+            with outfile:
+                outfile.write(MAGIC)
+                outfile.write(struct.pack("<Q", len(header_data)))
+                outfile.write(header_data + b"\0" * _padding(len(header_data)))
+                for name, code, data in sections:
+                    size = header["sections"][name][1]
+                    if isinstance(data, _SectionSpool):
+                        data.copy_to(outfile)
+                    else:
+                        outfile.write(data)
+                    outfile.write(b"\0" * _padding(size))
+            os.replace(tmp_path, self.path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+
+class ContigIndex:
+    """Read-only, memory-mapped view of a file written by ContigIndexWriter.
+    Column values are read straight from the mapping; nothing is decompressed
+    or parsed per row. Files compressed with a codec are decompressed into memory
+    as a whole when opened."""
+
+    def __init__(self, path, codec=None):
+        self.path = path
+        if codec is None or not codec.is_compressed():
+            with open(path, "rb") as infile:
+                self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                self._inode = os.fstat(infile.fileno()).st_ino
+        else:
+            self._mmap = None
+            with codec.open(path, "rb") as infile:
+                self._data = infile.read()
+            self._inode = os.stat(path).st_ino
+        # both support find() over a range of the file
+        self._source = self._data if self._mmap is None else self._mmap
+        self._buffer = memoryview(self._source)
+        self._views = []
+        try:
+            if self._buffer[:len(MAGIC)] != MAGIC:
+                raise ValueError("Not a contig index file: " + path)
+            header_len = struct.unpack_from("<Q", self._buffer, len(MAGIC))[0]
+            header_start = len(MAGIC) + 8
+            header = json.loads(bytes(self._buffer[header_start:header_start + header_len]))
+            if header["version"] != FORMAT_VERSION or header["byteorder"] != sys.byteorder:
+                raise ValueError("Unsupported contig index format: " + path)
+            self.num_rows = header["num_rows"]
+            self.shard_rows = header.get("shard_rows", SHARD_ROWS)
+            base = header_start + header_len + _padding(header_len)
+            self.sections = {}
+            self._section_starts = {}
+            for name, (offset, size, code) in header["sections"].items():
+                self._section_starts[name] = base + offset
+                view = self._buffer[base + offset:base + offset + size]
+                if code != 'B':
+                    view = view.cast(code)
+                self._views.append(view)
+                self.sections[name] = view
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_deleted(self):
+        """Whether the file was deleted (or replaced) since it was opened. The disk space
+        of a deleted file is only freed once it is not mapped anymore."""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None and not self._mmap.closed:
+            self._mmap.close()
+        self._data = None
+        self._source = None
+
+    def get_string(self, column, row):
+        offsets = self.sections[column + ".offsets"]
+        return str(self.sections[column + ".data"][offsets[row]:offsets[row + 1]], "utf-8")
+
+    def get_value(self, column, row):
+        if column in NUMERIC_COLUMNS:
+            value = self.sections[column][row]
+            return None if is_null(column, value) else value
+        return self.get_string(column, row)
+
+    def get_range_rows(self, column, min_value=None, max_value=None):
+        """Rows (in no particular order) with a non-null value of the numeric column
+        within the inclusive bounds; None bounds are open."""
+        values = self.sections[column]
+        order = self.sections.get(column + ".order")
+        if order is None:
+            # index built before the sorted column arrays were introduced
+            return [row for row in range(self.num_rows)
+                    if not is_null(column, values[row]) and
+                    (min_value is None or values[row] >= min_value) and
+                    (max_value is None or values[row] <= max_value)]
+        low = 0 if min_value is None else _bisect_values(order, values, min_value)
+        high = len(order) if max_value is None else _bisect_values(order, values, max_value,
+                                                                   right=True)
+        return order[low:high]
+
+    def has_key_rows(self, column):
+        return column + ".sorted" in self.sections
+
+    def get_key_rows(self, column, value, prefix=False):
+        """Rows (in no particular order) of the string column equal to the value, or
+        starting with it, ignoring case."""
+        key = get_key(value)
+        if not prefix and column + ".hash" in self.sections:
+            return self.get_hash_rows(column, key)
+        order = self.sections[column + ".sorted"]
+        keys = _RowKeys(self, column)
+        low = _bisect_values(order, keys, key)
+        # "\xff" never occurs in UTF-8, so it is greater than any continuation
+        high = _bisect_values(order, keys, key + b"\xff" if prefix else key, right=not prefix)
+        return order[low:high]
+
+    def get_hash_rows(self, column, key):
+        """Rows of the string column whose key (see get_key) is the given one, looked
+        up in the hash table of the column."""
+        table = self.sections[column + ".hash"]
+        mask = len(table) - 1
+        slot = zlib.crc32(key) & mask
+        rows = []
+        while table[slot]:
+            row = table[slot] - 1
+            if get_key(self.get_string(column, row)) == key:
+                rows.append(row)
+            slot = (slot + 1) & mask
+        # rows wrapped around the end of the table come first
+        return sorted(rows)
+
+    def get_contig(self, row):
+        return {column: self.get_value(column, row) for column in COLUMNS}
+
+    def has_search_text(self):
+        return SEARCH_COLUMN + ".data" in self.sections
+
+    def get_search_text(self, row):
+        """Lower-cased contig_id and description of a row (tab-joined)."""
+        if not self.has_search_text():
+            return "\t".join(self.get_string(column, row).lower() for column in TRIGRAM_COLUMNS)
+        return self.get_string(SEARCH_COLUMN, row)[:-1]
+
+    def search_text_contains(self, row, word):
+        """Whether the search text of the row contains the UTF-8 encoded lower-cased
+        word, without copying any of the text."""
+        offsets = self.sections[SEARCH_COLUMN + ".offsets"]
+        start = self._section_starts[SEARCH_COLUMN + ".data"]
+        return self._source.find(word, start + offsets[row], start + offsets[row + 1]) >= 0
+
+    def get_shards(self):
+        """List of the (first row, end row) ranges of the shards of the index."""
+        return [(first_row, min(first_row + self.shard_rows, self.num_rows))
+                for first_row in range(0, self.num_rows, self.shard_rows)]
+
+    def get_search_rows(self, word, first_row=0, end_row=None):
+        """Sorted rows (of the given range, all by default) whose search text contains
+        the UTF-8 encoded lower-cased word, found by searching their text at once."""
+        if end_row is None:
+            end_row = self.num_rows
+        offsets = self.sections[SEARCH_COLUMN + ".offsets"]
+        start = self._section_starts[SEARCH_COLUMN + ".data"]
+        end = start + offsets[end_row]
+        rows = []
+        pos = self._source.find(word, start + offsets[first_row], end)
+        while pos >= 0:
+            # rows end with a newline, so a word is never found across two rows
+            row = bisect.bisect_right(offsets, pos - start) - 1
+            rows.append(row)
+            pos = self._source.find(word, start + offsets[row + 1], end)
+        return rows
+
+    def has_trigrams(self):
+        return "trigrams.keys" in self.sections
+
+    def get_trigram_rows(self, word):
+        """Sorted rows whose contig_id or description (lower-cased) may contain the
+        lower-cased word, or None if the word is too short to be looked up."""
+        trigrams = get_trigrams(word.encode("utf-8"))
+        if not trigrams:
+            return None
+        keys = self.sections["trigrams.keys"]
+        offsets = self.sections["trigrams.offsets"]
+        postings = []
+        for trigram in trigrams:
+            pos = bisect.bisect_left(keys, trigram)
+            if pos == len(keys) or keys[pos] != trigram:
+                return []
+            postings.append(self.sections["trigrams.rows"][offsets[pos]:offsets[pos + 1]])
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for rows in postings[1:]:
+            candidates.intersection_update(rows)
+            if not candidates:
+                break
+        return sorted(candidates)
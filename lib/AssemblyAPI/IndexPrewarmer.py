@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import time
+import traceback
+
+from AssemblyAPI.LRUCache import LRUCache
+from AssemblyAPI.SingleFlight import FileLock
+
+try:
+    import uwsgi
+    from uwsgidecorators import postfork
+except ImportError:
+    # not served by uwsgi
+    uwsgi = None
+
+QUEUED = "queued"
+BUILDING = "building"
+READY = "ready"
+FAILED = "failed"
+REJECTED = "rejected"
+NOT_INDEXED = "not_indexed"
+
+
+class IndexPrewarmer:
+    """Builds assembly indexes (and their most common sort orders) ahead of the first
+    search with a bounded queue served by a few background threads. The state of the
+    refs submitted to this worker is kept in memory, other refs are reported from the
+    content of assembly_index_dir. Prewarmed indexes are not kept in the in-memory
+    caches of the worker, so they don't evict the ones in use.
+
+    The refs of the configuration are prewarmed at startup by a single process of the
+    node. Other refs can only be submitted by the admins of the service."""
+
+    def __init__(self, indexer, config):
+        self.indexer = indexer
+        self.num_threads = int(config.get("prewarm-threads", 2))
+        self.max_queue_size = int(config.get("prewarm-queue-size", 100))
+        self.sorts = [[["length", 0]], [["contig_id", 1]]]
+        self.debug = indexer.debug
+        # ref -> {"status", "error", "submitted", "finished"} of the recent submissions
+        # of this process
+        self.states = LRUCache(10000)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._workers_pid = None
+        # refs given in the configuration have to be readable without a token
+        self.config_refs = [ref.strip() for ref in config.get("prewarm-refs", "").split(",")
+                            if ref.strip()]
+        # held while it lives by the process prewarming the configured refs
+        self.node_lock = FileLock(indexer.single_flight.get_lock_file("prewarm"))
+        # user ids allowed to call submit
+        self.admins = {user.strip() for user in config.get("prewarm-admins", "").split(",")
+                       if user.strip()}
+
+    def start_on_startup(self):
+        """Start the workers at the startup of the server process, or, when uwsgi loads
+        the service before forking its worker processes, of each of them."""
+        if uwsgi is not None and uwsgi.masterpid() == os.getpid():
+            postfork(self.start)
+        else:
+            self.start()
+
+    def start(self):
+        """Start the workers of this process (once). The first process of the node to
+        start queues the configured refs."""
+        with self._lock:
+            self._start_workers()
+
+    def _start_workers(self):
+        # the service is forked after its construction, and worker threads don't survive
+        # a fork, so each process starts its own ones (on its first use) and forgets the
+        # states inherited from its parent
+        if self._workers_pid == os.getpid():
+            return
+        self.states = LRUCache(10000)
+        self._queue = queue.Queue(self.max_queue_size)
+        for _ in range(self.num_threads):
+            threading.Thread(target=self._run_worker, args=(self._queue,), daemon=True).start()
+        self._workers_pid = os.getpid()
+        if self.config_refs and self.node_lock.acquire(blocking=False):
+            self._submit(self.config_refs, None)
+
+    def submit(self, refs, token, user_id):
+        """Queue the refs for prewarming and return their statuses."""
+        if user_id not in self.admins:
+            raise ValueError("Only the admins of the service (prewarm-admins) can "
+                             "prewarm indexes")
+        with self._lock:
+            self._start_workers()
+            self._submit(refs, token)
+        return [self.get_state(ref) for ref in refs]
+
+    def _submit(self, refs, token):
+        for ref in refs:
+            state = self.states.get(ref)
+            if state is not None and state["status"] in (QUEUED, BUILDING):
+                continue
+            state = {"status": QUEUED, "error": None, "submitted": time.time(),
+                     "finished": None}
+            try:
+                self._queue.put_nowait((ref, token, state))
+            except queue.Full:
+                state.update({"status": REJECTED, "error": "Prewarm queue is full",
+                              "finished": time.time()})
+            self.states.put(ref, state)
+
+    def get_status(self, refs, token):
+        """Statuses of the refs, ready if the index is already built on this node."""
+        self.start()
+        ret = []
+        for ref in refs:
+            state = self.get_state(ref)
+            if state["status"] not in (QUEUED, BUILDING):
+                info = self.indexer.get_object_info(ref, token)
+                if os.path.isfile(self.indexer.get_index_file(info[8])):
+                    state.update({"status": READY, "error": None})
+                elif state["status"] == READY:
+                    # evicted since it was built
+                    state["status"] = NOT_INDEXED
+            ret.append(state)
+        return ret
+
+    def get_state(self, ref):
+        state = self.states.get(ref)
+        if state is None:
+            return {"ref": ref, "status": NOT_INDEXED, "error": None}
+        return {"ref": ref, "status": state["status"], "error": state["error"]}
+
+    def _run_worker(self, jobs):
+        while True:
+            ref, token, state = jobs.get()
+            state["status"] = BUILDING
+            try:
+                self.prewarm(ref, token)
+                state.update({"status": READY, "finished": time.time()})
+            except Exception as e:
+                if self.debug:
+                    traceback.print_exc()
+                state.update({"status": FAILED, "error": str(e), "finished": time.time()})
+            finally:
+                jobs.task_done()
+
+    def prewarm(self, ref, token):
+        if self.debug:
+            print(f"Prewarm: Assembly={ref}")
+            t1 = time.time()
+        with self.indexer.open_assembly_index(ref, token, cache=False) as (inner_chsum,
+                                                                         index):
+            for sort_by in self.sorts:
+                self.indexer.get_assembly_sorted_rows(inner_chsum, index, sort_by,
+                                                      cache=False)
+        if self.debug:
+            print(f"    (prewarm-time={time.time() - t1})")
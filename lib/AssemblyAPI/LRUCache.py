@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by the total size of the cached
+    values, as measured by the sizeof function (one unit per value by default).
+    Counts hits, misses and evictions."""
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        """Cache the value, unless it is larger than the cache. Returns whether it was
+        cached."""
+        size = self.sizeof(value)
+        with self._lock:
+            old_item = self._items.pop(key, None)
+            if old_item is not None:
+                self.size -= old_item[1]
+            if size > self.max_size:
+                return False
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            return True
+
+    def items(self):
+        """List of the cached (key, value) pairs, least recently used first."""
+        with self._lock:
+            return [(key, item[0]) for key, item in self._items.items()]
+
+    def remove(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def get_stats(self):
+        with self._lock:
+            return {"items": len(self._items), "size": self.size, "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import mmap
+import re
+import struct
+import sys
+from array import array
+
+from AssemblyAPI.Codecs import get_codec
+
+# Random access layout of a cached contig sequence:
+#
+#   MAGIC (8 bytes) | header length (uint64) | JSON header (padded to 8 bytes) | data
+#
+# Two formats are supported, as named by the "format" of the header:
+#
+# - "blocks": the sequence is split into blocks of "block_size" bases, each compressed
+#   on its own with the codec named in the header, and the header lists the offsets of
+#   the blocks (relative to the end of the header, plus the end of the last one).
+#   Reading a range of the sequence only decompresses the blocks it overlaps.
+# - "packed": the bases are packed 4 per byte (A, C, G and T as 0 to 3, most significant
+#   bits first). Runs of any other (IUPAC) code are listed in an exception table of
+#   run starts, ends and codes, and soft-masked (lower-case) runs in a mask table of
+#   starts and ends. The header gives the offset, size and typecode of each section
+#   like in contig index files, so the tables are used in place from the mapping.
+MAGIC = b"KBASMSEQ"
+FORMAT_VERSION = 1
+BLOCK_SIZE = 64 * 1024
+SUFFIX = ".seq"
+FORMATS = ["packed", "blocks"]
+ALIGNMENT = 8
+
+BASES = b"ACGT"
+PACKED_BASES = 4
+# base -> 2-bit code shifted to its position within a byte, for each position
+_PACK_TABLES = [bytes(max(BASES.find(bytes([char]).upper()), 0) << (6 - 2 * pos)
+                     for char in range(256)) for pos in range(PACKED_BASES)]
+# byte -> base at each position
+_UNPACK_TABLES = [bytes(BASES[byte >> (6 - 2 * pos) & 3] for byte in range(256))
+                  for pos in range(PACKED_BASES)]
+EXCEPTION_RUN = re.compile(rb"([^ACGT])\1*")
+MASKED_RUN = re.compile(rb"[a-z]+")
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _write_file(path, header, sections):
+    header_data = json.dumps(header).encode("utf-8")
+    header_data += b" " * _padding(len(MAGIC) + 8 + len(header_data))
+    with open(path, "wb") as outfile:
+        outfile.write(MAGIC)
+        outfile.write(struct.pack("<Q", len(header_data)))
+        outfile.write(header_data)
+        for data in sections:
+            outfile.write(data)
+
+
+def write_sequence(path, sequence, codec, block_size=BLOCK_SIZE):
+    """Write the sequence (bytes) in the "blocks" format."""
+    blocks = [codec.compress(sequence[start:start + block_size])
+              for start in range(0, len(sequence), block_size)]
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    _write_file(path, {"version": FORMAT_VERSION, "format": "blocks",
+                       "length": len(sequence), "block_size": block_size,
+                       "codec": codec.name, "offsets": offsets}, blocks)
+
+
+def pack_bases(sequence):
+    """Bytes of the 2-bit codes of the bases (other codes are packed as A)."""
+    sequence += b"A" * (-len(sequence) % PACKED_BASES)
+    num_bytes = len(sequence) // PACKED_BASES
+    # the codes at each position are ORed as big integers, a byte per packed byte
+    packed = 0
+    for pos, table in enumerate(_PACK_TABLES):
+        packed |= int.from_bytes(sequence[pos::PACKED_BASES].translate(table), "big")
+    return packed.to_bytes(num_bytes, "big")
+
+
+def unpack_bases(packed):
+    """Upper-case bases of packed bytes, PACKED_BASES per byte."""
+    bases = bytearray(len(packed) * PACKED_BASES)
+    for pos, table in enumerate(_UNPACK_TABLES):
+        bases[pos::PACKED_BASES] = packed.translate(table)
+    return bases
+
+
+def write_packed_sequence(path, sequence):
+    """Write the sequence (bytes) in the "packed" format."""
+    runs = [(match.start(), match.end(), match.group(1)[0])
+            for match in EXCEPTION_RUN.finditer(sequence.upper())]
+    masked = [(match.start(), match.end()) for match in MASKED_RUN.finditer(sequence)]
+    sections = [("exceptions.starts", array('Q', [run[0] for run in runs])),
+                ("exceptions.ends", array('Q', [run[1] for run in runs])),
+                ("masked.starts", array('Q', [run[0] for run in masked])),
+                ("masked.ends", array('Q', [run[1] for run in masked])),
+                ("exceptions.codes", array('B', [run[2] for run in runs])),
+                ("bases", pack_bases(sequence))]
+    header = {"version": FORMAT_VERSION, "format": "packed", "byteorder": sys.byteorder,
+              "length": len(sequence), "sections": {}}
+    offset = 0
+    datas = []
+    for name, data in sections:
+        code = data.typecode if isinstance(data, array) else 'B'
+        data = data.tobytes() if isinstance(data, array) else data
+        header["sections"][name] = [offset, len(data), code]
+        datas.append(data + b"\0" * _padding(len(data)))
+        offset += len(datas[-1])
+    _write_file(path, header, datas)
+
+
+class SequenceFile:
+    """Memory-mapped contig sequence written by write_sequence or write_packed_sequence.
+    In the "blocks" format, the last decompressed block is kept, so consecutive reads
+    from the same region decompress it once."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        self._views = []
+        try:
+            if self._mmap[:len(MAGIC)] != MAGIC:
+                raise ValueError("Not a contig sequence file: " + path)
+            header_len = struct.unpack_from("<Q", self._mmap, len(MAGIC))[0]
+            self._base = len(MAGIC) + 8 + header_len
+            header = json.loads(self._mmap[len(MAGIC) + 8:self._base])
+            self.format = header.get("format", "blocks")
+            if (header["version"] != FORMAT_VERSION or self.format not in FORMATS or
+                    header.get("byteorder", sys.byteorder) != sys.byteorder):
+                raise ValueError("Unsupported contig sequence format: " + path)
+            self.length = header["length"]
+            if self.format == "blocks":
+                self.block_size = header["block_size"]
+                self.codec = get_codec(header["codec"])
+                self._offsets = header["offsets"]
+            else:
+                self.sections = {}
+                for name, (offset, size, code) in header["sections"].items():
+                    view = self._buffer[self._base + offset:self._base + offset + size]
+                    if code != 'B':
+                        view = view.cast(code)
+                    self._views.append(view)
+                    self.sections[name] = view
+        except:
+            self.close()
+            raise
+        self._block_pos = None
+        self._block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # the views have to be released before the map can be closed
+        for view in self._views:
+            view.release()
+        self._buffer.release()
+        self._mmap.close()
+
+    def __len__(self):
+        return self.length
+
+    def _get_block(self, pos):
+        if pos != self._block_pos:
+            start = self._base + self._offsets[pos]
+            end = self._base + self._offsets[pos + 1]
+            self._block = self.codec.decompress(self._mmap[start:end])
+            self._block_pos = pos
+        return self._block
+
+    def read(self, start, length):
+        """Bytes of the sequence from start, shorter than length past its end."""
+        end = min(start + length, self.length)
+        if start >= end:
+            return b""
+        if self.format == "packed":
+            return self._read_packed(start, end)
+        if not self.codec.is_compressed():
+            # the uncompressed blocks follow each other
+            return self._mmap[self._base + start:self._base + end]
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        parts = [self._get_block(pos) for pos in range(first_block, last_block + 1)]
+        offset = first_block * self.block_size
+        if len(parts) == 1:
+            return parts[0][start - offset:end - offset]
+        return b"".join(parts)[start - offset:end - offset]
+
+    def _iter_runs(self, name, start, end):
+        """(position, start, end) of the runs of a table overlapping start:end, clipped
+        to it and relative to start."""
+        starts = self.sections[name + ".starts"]
+        ends = self.sections[name + ".ends"]
+        pos = bisect.bisect_right(ends, start)
+        while pos < len(starts) and starts[pos] < end:
+            yield pos, max(starts[pos], start) - start, min(ends[pos], end) - start
+            pos += 1
+
+    def _read_packed(self, start, end):
+        first_byte = start // PACKED_BASES
+        last_byte = (end - 1) // PACKED_BASES + 1
+        offset = start - first_byte * PACKED_BASES
+        bases = unpack_bases(bytes(self.sections["bases"][first_byte:last_byte]))
+        bases = bases[offset:offset + end - start]
+        codes = self.sections["exceptions.codes"]
+        for pos, run_start, run_end in self._iter_runs("exceptions", start, end):
+            bases[run_start:run_end] = bytes([codes[pos]]) * (run_end - run_start)
+        for _, run_start, run_end in self._iter_runs("masked", start, end):
+            bases[run_start:run_end] = bases[run_start:run_end].lower()
+        return bytes(bases)
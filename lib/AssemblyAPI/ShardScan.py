@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from AssemblyAPI.Codecs import get_codec
+from AssemblyAPI.ContigIndex import ContigIndex
+
+# compressed indexes read by a scanning process: path -> ContigIndex
+_open_indexes = OrderedDict()
+MAX_OPEN_INDEXES = 4
+
+
+def term_matches(index, row, term):
+    """Whether the row matches a (field, lower-cased value, prefix) query term."""
+    field, value, prefix = term
+    text = index.get_string(field, row).lower()
+    if field == "description":
+        return value in text
+    return text.startswith(value) if prefix else text == value
+
+
+def match_rows(index, first_row, end_row, query_terms):
+    """Array of the rows of the range matching all query terms, in row order. Words
+    are searched in the text of all the rows of the range at once."""
+    words = [value.encode("utf-8") for field, value, _ in query_terms if field is None]
+    matches = None
+    for word in words:
+        word_rows = index.get_search_rows(word, first_row, end_row)
+        if matches is None:
+            matches = word_rows
+        else:
+            matching_rows = set(word_rows)
+            matches = [row for row in matches if row in matching_rows]
+    if matches is None:
+        matches = range(first_row, end_row)
+    terms = [term for term in query_terms if term[0] is not None]
+    return array('I', (row for row in matches
+                       if all(term_matches(index, row, term) for term in terms)))
+
+
+def scan_shard(path, codec_name, first_row, end_row, query_terms):
+    """Run in a scanning process: bytes of the array of the matching rows of a shard."""
+    codec = get_codec(codec_name)
+    if not codec.is_compressed():
+        # mapping the file again is cheap, while keeping it mapped would hold on to its
+        # disk space once it is evicted
+        with ContigIndex(path, codec) as index:
+            return match_rows(index, first_row, end_row, query_terms).tobytes()
+    index = _open_indexes.pop(path, None)
+    if index is None or index.is_deleted():
+        index = ContigIndex(path, codec)
+    _open_indexes[path] = index
+    while len(_open_indexes) > MAX_OPEN_INDEXES:
+        _open_indexes.popitem(last=False)[1].close()
+    return match_rows(index, first_row, end_row, query_terms).tobytes()
+
+
+def find_python():
+    """Path of a Python interpreter to start the fork server of the scanning processes
+    with, or None. Under uwsgi sys.executable is the uwsgi binary rather than Python."""
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    version = sys.version_info
+    for name in (f"python{version.major}.{version.minor}", f"python{version.major}"):
+        path = os.path.join(sys.exec_prefix, "bin", name)
+        if os.access(path, os.X_OK):
+            return path
+    return None
+
+
+class ShardScanner:
+    """Matches queries against the shards of large contig indexes in a pool of worker
+    processes, so scans which can't use any lookup section are spread over several
+    cores. Each process maps the index file by itself."""
+
+    def __init__(self, num_processes):
+        self.num_processes = num_processes
+        # without an interpreter to start them with, shards are scanned in-process
+        self.python = find_python() if num_processes > 1 else None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def is_enabled(self, index):
+        return (self.num_processes > 1 and self.python is not None and
+                len(index.get_shards()) > 1)
+
+    def _get_pool(self):
+        # a pool doesn't survive a fork of the server process, so each process starts
+        # its own one. The server process runs threads, so workers aren't forked from
+        # it but from a fork server which only preloads this module (not the server
+        # module)
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                context = multiprocessing.get_context("forkserver")
+                context.set_executable(self.python)
+                context.set_forkserver_preload(["AssemblyAPI.ShardScan"])
+                self._pool = ProcessPoolExecutor(max_workers=self.num_processes,
+                                                 mp_context=context)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def scan(self, index, codec, query_terms):
+        """Array of all the rows of the index matching the query terms, in row order,
+        combined from the matches of each shard."""
+        pool = self._get_pool()
+        futures = [pool.submit(scan_shard, index.path, codec.name, first_row, end_row,
+                               query_terms)
+                   for first_row, end_row in index.get_shards()]
+        matches = array('I')
+        for future in futures:
+            matches.frombytes(future.result())
+        return matches
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import os
+import threading
+
+
+class FileLock:
+    """Advisory lock (flock) on a lock file, shared between processes of this node.
+    Can be used as a context manager (blocking) or through acquire/release."""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._file = None
+
+    def acquire(self, blocking=True):
+        lock_file = open(self.path, "a")
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file.fileno(), flags)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        except:
+            lock_file.close()
+            raise
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SingleFlight:
+    """Makes sure that at most one builder per key runs at a time on this node: threads
+    of this process wait on a per-key lock, other processes on a lock file in lock_dir.
+    Whoever gets the lock first builds, the others find the result already done. The
+    lock file of a key is removed once built."""
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        if not os.path.isdir(self.lock_dir):
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def get_lock_file(self, key):
+        return os.path.join(self.lock_dir, key + ".lock")
+
+    def run(self, key, is_done, build):
+        """Call build() unless is_done() returns True, once the key is locked."""
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = [threading.Lock(), 0]
+            lock[1] += 1
+        try:
+            with lock[0]:
+                if is_done():
+                    return
+                lock_file = self.get_lock_file(key)
+                with FileLock(lock_file):
+                    if is_done():
+                        return
+                    build()
+                    # later callers find the result done before locking, so the lock
+                    # file is not needed anymore (and lock files would pile up)
+                    os.remove(lock_file)
+        finally:
+            with self._locks_guard:
+                lock[1] -= 1
+                if lock[1] == 0:
+                    del self._locks[key]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import codecs
+import json
+import random
+
+import requests
+
+from installed_clients.baseclient import ServerError
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+class JSONStreamReader:
+    """Minimal incremental JSON reader over an iterator of byte chunks. It can walk down
+    a path of object keys / array positions and then yield the members of the container
+    found there one at a time, so only the member being decoded is held in memory."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self, min_size=1):
+        if self.pos > 0:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        target = len(self.buffer) + min_size
+        while len(self.buffer) < target and not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                self.buffer += self.decoder.decode(b"", final=True)
+            else:
+                self.buffer += self.decoder.decode(chunk)
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._read_more()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Unexpected JSON content, '{char}' was expected at: " +
+                             self.buffer[self.pos:self.pos + 50])
+        self.pos += 1
+
+    def read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # a number at the very end of the buffer (or cut before its fraction or
+                # exponent) may continue in the next chunk
+                if self.eof or not (isinstance(value, (int, float)) and
+                                    (end == len(self.buffer) or
+                                     self.buffer[end] in NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow the buffer geometrically so that large values are not re-parsed
+            # too many times
+            self._read_more(max(len(self.buffer) - self.pos, 65536))
+
+    def _enter_key(self, key):
+        self._expect("{")
+        while True:
+            char = self._peek()
+            if char == "}" or char is None:
+                raise ValueError(f"Key '{key}' was not found in JSON response")
+            if char == ",":
+                self.pos += 1
+                continue
+            name = self.read_value()
+            self._expect(":")
+            if name == key:
+                return
+            self.read_value()
+
+    def _enter_first_item(self):
+        self._expect("[")
+        if self._peek() == "]":
+            raise ValueError("Empty array in JSON response")
+
+    def iter_items(self, path):
+        """Yield the values of the object (or the elements of the array) found at the
+        given path of keys (str) and first-array-element markers (0)."""
+        for step in path:
+            if step == 0:
+                self._enter_first_item()
+            else:
+                self._enter_key(step)
+        char = self._peek()
+        if char not in ("{", "["):
+            raise ValueError("JSON object or array was expected at: " +
+                             self.buffer[self.pos:self.pos + 50])
+        self.pos += 1
+        closing = "}" if char == "{" else "]"
+        while True:
+            char = self._peek()
+            if char == closing:
+                self.pos += 1
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            if char is None:
+                raise ValueError("Unexpected end of JSON response")
+            if closing == "}":
+                self.read_value()
+                self._expect(":")
+            yield self.read_value()
+
+
+def iter_object_items(ws_url, token, ref, included, data_path, timeout=30 * 60):
+    """Call Workspace.get_objects2 for a single object and yield the items of the
+    container at data_path (e.g. ["contigs"]) inside the object data, decoding the
+    response as it is downloaded instead of loading it as a whole."""
+    body = json.dumps({"method": "Workspace.get_objects2",
+                       "params": [{"objects": [{"ref": ref, "included": included}]}],
+                       "version": "1.1",
+                       "id": str(random.random())[2:]})
+    headers = {"AUTHORIZATION": token} if token else {}
+    with requests.post(ws_url, data=body, headers=headers, timeout=timeout,
+                       stream=True) as response:
+        if not response.ok:
+            response.encoding = "utf-8"
+            try:
+                error = response.json()["error"]
+            except Exception:
+                error = None
+            if error is None:
+                response.raise_for_status()
+            raise ServerError(**error)
+        # the transfer is (gzip) compressed when the server supports it, iter_content
+        # decompresses it on the fly
+        reader = JSONStreamReader(response.iter_content(chunk_size=65536))
+        yield from reader.iter_items(["result", 0, "data", 0, "data"] + list(data_path))
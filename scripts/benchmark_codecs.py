@@ -0,0 +1,94 @@
+"""Compare the codecs available for the contig index and sequence cache files (and the
+packed sequence format) on synthetic assemblies: build time, file size and read/search
+throughput.
+
+Usage: PYTHONPATH=lib python scripts/benchmark_codecs.py [num_contigs ...]
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+from AssemblyAPI.Codecs import CODECS
+from AssemblyAPI.ContigIndex import ContigIndex, ContigIndexWriter
+from AssemblyAPI.SequenceStore import (SUFFIX, SequenceFile, write_packed_sequence,
+                                       write_sequence)
+
+NUM_SEQUENCE_READS = 1000
+SEQUENCE_READ_LENGTH = 1000
+
+
+def make_contigs(num_contigs, seed=0):
+    rnd = random.Random(seed)
+    for pos in range(num_contigs):
+        contig_id = f"NODE_{pos + 1}_length_{rnd.randint(100, 100000)}"
+        yield (contig_id, rnd.choice(["", "plasmid", "chromosome", f"contig {pos}"]),
+               rnd.randint(100, 100000), round(rnd.random(), 5), rnd.choice([0, 1, None]),
+               rnd.randint(0, 50), hashlib.md5(contig_id.encode()).hexdigest())
+
+
+def benchmark_index(codec, num_contigs, work_dir):
+    path = os.path.join(work_dir, "index.idx" + codec.suffix)
+    t1 = time.time()
+    with ContigIndexWriter(path, trigrams=True, codec=codec) as writer:
+        for contig in make_contigs(num_contigs):
+            writer.add(*contig)
+        writer.write()
+    build_time = time.time() - t1
+    t1 = time.time()
+    with ContigIndex(path, codec) as index:
+        open_time = time.time() - t1
+        t1 = time.time()
+        found = len(index.get_search_rows(b"plasmid"))
+        scan_time = time.time() - t1
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {"build_s": build_time, "size_mb": size / 2 ** 20, "open_s": open_time,
+            "scan_rows_per_s": num_contigs / scan_time, "found": found}
+
+
+def benchmark_sequences(write, num_contigs, work_dir, contig_length=100000):
+    rnd = random.Random(0)
+    num_contigs = max(1, min(num_contigs, 100))
+    sequences = [bytes(rnd.choices(b"ACGT", k=contig_length)) for _ in range(num_contigs)]
+    paths = []
+    t1 = time.time()
+    for pos, sequence in enumerate(sequences):
+        path = os.path.join(work_dir, f"contig_{pos}" + SUFFIX)
+        write(path, sequence)
+        paths.append(path)
+    write_time = time.time() - t1
+    size = sum(os.path.getsize(path) for path in paths)
+    t1 = time.time()
+    for _ in range(NUM_SEQUENCE_READS):
+        with SequenceFile(rnd.choice(paths)) as contig:
+            contig.read(rnd.randint(0, contig_length - SEQUENCE_READ_LENGTH),
+                        SEQUENCE_READ_LENGTH)
+    read_time = time.time() - t1
+    for path in paths:
+        os.remove(path)
+    return {"write_s": write_time, "size_mb": size / 2 ** 20,
+            "reads_per_s": NUM_SEQUENCE_READS / read_time}
+
+
+def print_row(name, results):
+    print(f"{name:>8}  " + "  ".join(f"{key}={value:.3f}" if isinstance(value, float)
+                                     else f"{key}={value}" for key, value in results.items()))
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_contigs in sizes:
+            print(f"Contig index, {num_contigs} contigs:")
+            for codec in CODECS.values():
+                print_row(codec.name, benchmark_index(codec, num_contigs, work_dir))
+            print(f"Sequence cache, {min(num_contigs, 100)} contigs of 100kb:")
+            for codec in CODECS.values():
+                print_row(codec.name, benchmark_sequences(
+                    lambda path, sequence: write_sequence(path, sequence, codec),
+                    num_contigs, work_dir))
+            print_row("packed", benchmark_sequences(write_packed_sequence, num_contigs,
+                                                    work_dir))
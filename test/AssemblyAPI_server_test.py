@@ -196,6 +196,126 @@ class AssemblyAPITest(unittest.TestCase):
         self.assertEqual(ret['contigs'][1]['contig_id'], 'NZ_ALQT01000003')
         self.assertEqual(ret['contigs'][2]['contig_id'], 'NZ_ALQT01000005')
 
+    def test_search_assembly_cursor(self):
+        search_params = {'ref': self.assembly_ref_1, 'limit': 4, 'sort_by': [['gc', 1]]}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 15)
+        contig_ids = [c['contig_id'] for c in ret['contigs']]
+        while ret['cursor']:
+            search_params['cursor'] = ret['cursor']
+            ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+            self.assertEqual(ret['num_found'], 15)
+            self.assertEqual(ret['start'], len(contig_ids))
+            contig_ids += [c['contig_id'] for c in ret['contigs']]
+        self.assertEqual(len(contig_ids), 15)
+        self.assertEqual(contig_ids[:3], ['NZ_ALQT01000009', 'NZ_ALQT01000003',
+                                          'NZ_ALQT01000005'])
+
+        # cursor from a different query
+        search_params['query'] = 'ALQT01000015'
+        with self.assertRaisesRegex(ValueError, 'cursor doesn\'t match'):
+            self.getImpl().search_contigs(self.ctx, search_params)
+
+    def test_search_assembly_filters(self):
+        search_params = {'ref': self.assembly_ref_1, 'sort_by': [['length', 0]],
+                         'filters': {'length': {'min': 600}, 'gc': {'max': 0.4}}}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 4)
+        self.assertEqual([c['contig_id'] for c in ret['contigs']],
+                         ['NZ_ALQT01000007', 'NZ_ALQT01000013', 'NZ_ALQT01000005',
+                          'NZ_ALQT01000008'])
+
+        # combined with a query
+        search_params = {'ref': self.assembly_ref_1, 'query': 'ALQT0100001',
+                         'filters': {'length': {'min': 600, 'max': 700}}}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 1)
+        self.assertEqual(ret['contigs'][0]['contig_id'], 'NZ_ALQT01000012')
+
+        with self.assertRaisesRegex(ValueError, 'Unknown filter'):
+            self.getImpl().search_contigs(self.ctx, {'ref': self.assembly_ref_1,
+                                                     'filters': {'md5': {'min': 1}}})
+
+    def test_search_assembly_scoped_query(self):
+        search_params = {'ref': self.assembly_ref_1, 'query': 'contig_id:NZ_ALQT0100001*'}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 6)
+        self.assertEqual(ret['contigs'][0]['contig_id'], 'NZ_ALQT01000010')
+
+        search_params = {'ref': self.assembly_ref_1, 'query': 'contig_id:nz_alqt01000015'}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 1)
+        md5 = ret['contigs'][0]['md5']
+
+        search_params = {'ref': self.assembly_ref_1, 'query': 'contig_id:ALQT01000015'}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 0)
+
+        search_params = {'ref': self.assembly_ref_1, 'query': 'md5:' + md5}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 1)
+        self.assertEqual(ret['contigs'][0]['contig_id'], 'NZ_ALQT01000015')
+
+        search_params = {'ref': self.assembly_ref_1, 'query': 'description:"a description"'}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 1)
+        self.assertEqual(ret['contigs'][0]['contig_id'], 'NZ_ALQT01000015')
+
+    def test_search_assembly_multiple_refs(self):
+        search_params = {'refs': [self.assembly_ref_1, self.contig_set_ref], 'limit': 3,
+                         'query': 'ALQT01000010', 'sort_by': [['gc', 0]]}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        single = self.getImpl().search_contigs(self.ctx, {'ref': self.contig_set_ref,
+                                                          'query': 'ALQT01000010'})[0]
+        self.assertEqual(ret['num_found'], 1 + single['num_found'])
+        self.assertEqual(ret['contigs'][0]['contig_id'], 'NZ_ALQT01000010')
+        self.assertEqual(ret['contigs'][0]['ref'], self.assembly_ref_1)
+
+        # the same assembly twice, ties keep the order of refs
+        search_params = {'refs': [self.assembly_ref_1, self.assembly_ref_1], 'limit': 4,
+                         'sort_by': [['gc', 0]]}
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['num_found'], 30)
+        self.assertEqual([c['contig_id'] for c in ret['contigs']],
+                         ['NZ_ALQT01000010', 'NZ_ALQT01000010', 'NZ_ALQT01000004',
+                          'NZ_ALQT01000004'])
+        search_params['cursor'] = ret['cursor']
+        ret = self.getImpl().search_contigs(self.ctx, search_params)[0]
+        self.assertEqual(ret['start'], 4)
+
+    def test_summarize_contigs(self):
+        params = {'ref': self.assembly_ref_1, 'num_bins': 4, 'quantiles': [0, 0.5, 1]}
+        ret = self.getImpl().summarize_contigs(self.ctx, params)[0]
+        self.assertEqual(ret['num_found'], 15)
+        self.assertEqual(ret['total_length'], 7018)
+        self.assertEqual(ret['n50'], 689)
+        self.assertEqual(ret['l50'], 4)
+        lengths = ret['columns']['length']
+        self.assertEqual(lengths['count'], 15)
+        self.assertEqual(lengths['quantiles'], [8, 350, 1320])
+        self.assertEqual(lengths['histogram']['bin_edges'], [8, 336, 664, 992, 1320])
+        self.assertEqual(lengths['histogram']['counts'], [7, 3, 4, 1])
+        self.assertEqual(set(ret['columns']), {'length', 'gc', 'N_count'})
+
+        # only the contigs matching the filters
+        params = {'ref': self.assembly_ref_1, 'columns': ['length'],
+                  'filters': {'length': {'min': 600}}}
+        ret = self.getImpl().summarize_contigs(self.ctx, params)[0]
+        self.assertEqual(ret['num_found'], 5)
+        self.assertEqual(ret['columns']['length']['sum'], 4230)
+        self.assertEqual(ret['n50'], 830)
+
+    def test_prewarm_indexes(self):
+        ret = self.getImpl().prewarm_indexes(self.ctx, {'refs': [self.contig_set_ref_2]})[0]
+        self.assertEqual(ret['statuses'][0]['ref'], self.contig_set_ref_2)
+        self.assertIn(ret['statuses'][0]['status'], ['queued', 'building', 'ready'])
+        for _ in range(60):
+            ret = self.getImpl().get_index_status(self.ctx, {'refs': [self.contig_set_ref_2]})[0]
+            if ret['statuses'][0]['status'] not in ['queued', 'building']:
+                break
+            time.sleep(1)
+        self.assertEqual(ret['statuses'][0]['status'], 'ready')
+
     def test_get_assembly_id(self):
         ret = self.getImpl().get_assembly_id(self.ctx, self.obj_ref)
         self.assertEqual(ret[0], 'GCF_000288855.1_assembly')
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from AssemblyAPI import CacheManifest as cache_manifest
+from AssemblyAPI.CacheManifest import CacheManifest
+
+
+class CacheManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def add_entry(self, manifest, key, size):
+        os.makedirs(manifest.get_entry_dir(key))
+        with open(os.path.join(manifest.get_entry_dir(key), "data"), "wb") as outfile:
+            outfile.write(b"x" * size)
+        manifest.add(key)
+
+    def get_entries(self):
+        return sorted(name for name in os.listdir(self.cache_dir)
+                      if os.path.isdir(os.path.join(self.cache_dir, name)) and
+                      name != cache_manifest.LOCK_DIR)
+
+    def test_least_recently_used_evicted(self):
+        manifest = CacheManifest(self.cache_dir, 300)
+        for key in ["a", "b", "c"]:
+            self.add_entry(manifest, key, 100)
+            time.sleep(0.01)
+        manifest._entries["a"][1] -= cache_manifest.ACCESS_RESOLUTION
+        manifest.touch("a")
+        self.add_entry(manifest, "d", 100)
+        self.assertEqual(self.get_entries(), ["a", "c", "d"])
+        self.add_entry(manifest, "e", 250)
+        self.assertEqual(self.get_entries(), ["e"])
+
+    def test_pinned_entry_survives_eviction(self):
+        manifest = CacheManifest(self.cache_dir, 250)
+        self.add_entry(manifest, "a", 100)
+        time.sleep(0.01)
+        self.add_entry(manifest, "b", 100)
+        with manifest.pin("a"):
+            self.add_entry(manifest, "c", 100)
+            self.assertEqual(self.get_entries(), ["a", "c"])
+        # still the least recently used one once unpinned
+        self.add_entry(manifest, "d", 100)
+        self.assertEqual(self.get_entries(), ["c", "d"])
+
+    def test_shared_between_processes(self):
+        first = CacheManifest(self.cache_dir, 250)
+        second = CacheManifest(self.cache_dir, 250)
+        self.add_entry(first, "a", 100)
+        time.sleep(0.01)
+        self.add_entry(second, "b", 100)
+        time.sleep(0.01)
+        self.add_entry(first, "c", 100)
+        self.assertEqual(self.get_entries(), ["b", "c"])
+        self.assertEqual(sorted(first._entries), ["b", "c"])
+        second.touch("c")
+        self.assertEqual(sorted(second._entries), ["b", "c"])
+        self.assertEqual(second._total_size, 200)
+
+    def test_manifest_compacted(self):
+        manifest = CacheManifest(self.cache_dir, 1000)
+        self.add_entry(manifest, "a", 10)
+        for _ in range(3 * cache_manifest.MIN_RECORDS):
+            manifest._entries["a"][1] -= cache_manifest.ACCESS_RESOLUTION
+            manifest.touch("a")
+        with open(manifest.path, "rb") as infile:
+            self.assertLess(len(infile.readlines()), cache_manifest.MIN_RECORDS + 3)
+        self.assertLess(len(manifest._heap), cache_manifest.MIN_RECORDS + 3)
+        other = CacheManifest(self.cache_dir, 1000)
+        self.add_entry(other, "b", 10)
+        self.assertEqual(other._entries["a"], manifest._entries["a"])
+        self.assertEqual(other._total_size, 20)
+
+    def test_cache_dir_without_manifest(self):
+        os.makedirs(os.path.join(self.cache_dir, "old"))
+        with open(os.path.join(self.cache_dir, "old", "data"), "wb") as outfile:
+            outfile.write(b"x" * 200)
+        manifest = CacheManifest(self.cache_dir, 250)
+        self.add_entry(manifest, "new", 100)
+        self.assertEqual(self.get_entries(), ["new"])
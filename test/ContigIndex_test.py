@@ -0,0 +1,126 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from AssemblyAPI import ContigIndex as contig_index
+from AssemblyAPI.ContigIndex import ContigIndex, ContigIndexWriter, _SortSpool, get_key
+
+
+class ContigIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+
+    def write_index(self, contig_ids, name="contigs.idx", **kwargs):
+        path = os.path.join(self.index_dir, name)
+        with ContigIndexWriter(path, **kwargs) as writer:
+            for pos, contig_id in enumerate(contig_ids):
+                writer.add(contig_id, f"contig {pos}", 1000 + pos % 17, 0.5, 0, 0,
+                           f"md5_{pos % 5}")
+            writer.write()
+        return path
+
+    def get_expected_rows(self, contig_ids, key, prefix=False):
+        return [row for row, contig_id in enumerate(contig_ids)
+                if (get_key(contig_id).startswith(key) if prefix else
+                    get_key(contig_id) == key)]
+
+    def test_hash_table_wraps_around(self):
+        # 20 rows make a table of 64 slots, these ids all have the last one as home slot
+        last_slot_ids = ["Node_14", "node_122", "NODE_226", "node_258", "node_300"]
+        for contig_id in last_slot_ids:
+            self.assertEqual(zlib.crc32(get_key(contig_id)) & 63, 63)
+        contig_ids = [f"other_{pos}" for pos in range(14)] + last_slot_ids + ["node_14"]
+        with ContigIndex(self.write_index(contig_ids)) as index:
+            table = index.sections["contig_id.hash"]
+            self.assertEqual(len(table), 64)
+            self.assertEqual(sum(1 for slot in table if slot), len(contig_ids))
+            # the rows homed at the last slot fill it, then free slots from the first one
+            self.assertIn(table[63] - 1, range(14, 20))
+            self.assertLessEqual(set(range(14, 20)),
+                                 {table[slot] - 1 for slot in [63] + list(range(32))})
+            for contig_id in contig_ids + ["NODE_14", "missing", ""]:
+                with self.subTest(contig_id=contig_id):
+                    key = get_key(contig_id)
+                    self.assertEqual(index.get_key_rows("contig_id", contig_id),
+                                     self.get_expected_rows(contig_ids, key))
+            self.assertEqual(index.get_key_rows("contig_id", "node_14"), [14, 19])
+
+    def test_hash_rows_match_all_rows(self):
+        rand = random.Random(0)
+        contig_ids = [rand.choice(["NODE", "node", "contig", "Contig_é"]) +
+                      f"_{rand.randrange(300)}" for _ in range(1000)]
+        with ContigIndex(self.write_index(contig_ids)) as index:
+            for contig_id in set(contig_ids[:200]):
+                key = get_key(contig_id)
+                self.assertEqual(index.get_hash_rows("contig_id", key),
+                                 self.get_expected_rows(contig_ids, key))
+
+    def test_prefix_rows(self):
+        rand = random.Random(1)
+        contig_ids = [rand.choice(["NODE", "node", "contig", "Contig_é", "contigé"]) +
+                      f"_{rand.randrange(300)}" for _ in range(1000)]
+        with ContigIndex(self.write_index(contig_ids)) as index:
+            for prefix in ["", "node", "NODE_1", "node_29", "contig", "contig_é", "CONTIGÉ",
+                           "node_299", "node_3000", "z", "a"]:
+                with self.subTest(prefix=prefix):
+                    key = get_key(prefix)
+                    self.assertEqual(
+                        sorted(index.get_key_rows("contig_id", prefix, prefix=True)),
+                        self.get_expected_rows(contig_ids, key, prefix=True))
+            # md5 has no hash table, exact values are looked up by bisection too
+            self.assertNotIn("md5.hash", index.sections)
+            self.assertEqual(sorted(index.get_key_rows("md5", "MD5_3")),
+                             [row for row in range(1000) if row % 5 == 3])
+
+
+class SpoolMergeTest(unittest.TestCase):
+    """Indexes written with tiny buffers (many spooled runs, blocks and merge passes)
+    are the same as the ones sorted in memory."""
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+
+    def write_index(self, name, contigs):
+        path = os.path.join(self.index_dir, name)
+        with ContigIndexWriter(path, trigrams=True) as writer:
+            for contig in contigs:
+                writer.add(*contig)
+            writer.write()
+        with open(path, "rb") as infile:
+            return infile.read()
+
+    def test_sort_spool_merges_runs(self):
+        rand = random.Random(0)
+        records = [(rand.randrange(50), rand.randbytes(rand.randrange(20)), pos)
+                   for pos in range(1000)]
+        with mock.patch.multiple(contig_index, SORT_BUFFER_ITEMS=7, SORT_BLOCK_ITEMS=3,
+                                 SORT_BLOCK_BYTES=16, SORT_MAX_RUNS=4):
+            spool = _SortSpool(self.index_dir)
+            try:
+                for record in records:
+                    spool.append(record)
+                self.assertEqual(list(spool), sorted(records))
+                self.assertLessEqual(len(spool.runs), 4)
+            finally:
+                spool.close()
+
+    def test_index_written_with_small_buffers(self):
+        rand = random.Random(1)
+        contigs = [(f"{rand.choice(['NODE', 'contig'])}_{rand.randrange(500)}",
+                    f"{rand.choice(['plasmid', 'chromosome', 'scaffold'])} {pos % 37}",
+                    rand.choice([None, rand.randrange(100000)]),
+                    rand.choice([None, rand.random()]), rand.choice([None, 0, 1]),
+                    rand.randrange(10), f"md5_{rand.randrange(300)}")
+                   for pos in range(2000)]
+        expected = self.write_index("memory.idx", contigs)
+        with mock.patch.multiple(contig_index, SORT_BUFFER_ITEMS=50, SORT_BLOCK_ITEMS=8,
+                                 SORT_BLOCK_BYTES=64, SORT_MAX_RUNS=3,
+                                 POSTINGS_BUFFER_ITEMS=300, POSTINGS_RECORD_ROWS=5):
+            self.assertEqual(self.write_index("spooled.idx", contigs), expected)
@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+from AssemblyAPI.LRUCache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(3)
+        for key in ["a", "b", "c"]:
+            self.assertTrue(cache.put(key, key.upper()))
+        self.assertEqual(cache.get("a"), "A")
+        cache.put("d", "D")
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.items(), [("c", "C"), ("a", "A"), ("d", "D")])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_stats(), {"items": 3, "size": 3, "max_size": 3,
+                                             "hits": 1, "misses": 1, "evictions": 1})
+
+    def test_bounded_by_size(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put("a", "x" * 4)
+        cache.put("b", "x" * 4)
+        cache.put("c", "x" * 4)
+        self.assertEqual([key for key, _ in cache.items()], ["b", "c"])
+        self.assertEqual(cache.size, 8)
+        # larger than the cache: not cached, and the older value of the key is dropped
+        self.assertFalse(cache.put("b", "x" * 11))
+        self.assertEqual([key for key, _ in cache.items()], ["c"])
+        self.assertEqual(cache.size, 4)
+        # replacing a value updates the size
+        cache.put("c", "x" * 10)
+        self.assertEqual(cache.size, 10)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_remove(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put("a", "xyz")
+        cache.remove("a")
+        cache.remove("missing")
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_concurrent_puts(self):
+        cache = LRUCache(50)
+
+        def put_all(offset):
+            for pos in range(1000):
+                cache.put(offset + pos, pos)
+                cache.get(offset + pos // 2)
+
+        threads = [threading.Thread(target=put_all, args=(offset,))
+                   for offset in range(0, 8000, 1000)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 50)
+        self.assertEqual(cache.size, 50)
+        self.assertEqual(cache.evictions, 8000 - 50)
@@ -0,0 +1,79 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from AssemblyAPI.Codecs import get_codec
+from AssemblyAPI.SequenceStore import (SequenceFile, pack_bases, unpack_bases,
+                                       write_packed_sequence, write_sequence)
+
+
+class SequenceFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.seq_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.seq_dir)
+
+    def write_packed(self, sequence):
+        path = os.path.join(self.seq_dir, "contig.seq")
+        write_packed_sequence(path, sequence)
+        return SequenceFile(path)
+
+    def check_all_reads(self, seq_file, sequence):
+        for start in range(len(sequence) + 1):
+            for length in range(len(sequence) - start + 2):
+                self.assertEqual(seq_file.read(start, length),
+                                 sequence[start:start + length], (start, length))
+
+    def test_packed_bases(self):
+        for length in range(9):
+            with self.subTest(length=length):
+                sequence = bytes(random.Random(length).choice(b"ACGT") for _ in range(length))
+                packed = pack_bases(sequence)
+                self.assertEqual(len(packed), (length + 3) // 4)
+                self.assertEqual(bytes(unpack_bases(packed)[:length]), sequence)
+
+    def test_packed_lengths_not_multiple_of_4(self):
+        for length in [1, 2, 3, 5, 6, 7, 13]:
+            with self.subTest(length=length):
+                sequence = b"GATTACAGATTACA"[:length]
+                with self.write_packed(sequence) as seq_file:
+                    self.assertEqual(len(seq_file), length)
+                    self.check_all_reads(seq_file, sequence)
+
+    def test_packed_exception_runs(self):
+        # runs of other codes at the ends, next to each other and within a byte
+        sequence = b"NNACGTRYNNNNNACGTACGTKACGTNAAAAAAAAASWNN"
+        with self.write_packed(sequence) as seq_file:
+            self.assertEqual(bytes(seq_file.sections["exceptions.codes"]), b"NRYNKNSWN")
+            self.check_all_reads(seq_file, sequence)
+
+    def test_packed_masked_runs(self):
+        # soft-masked runs, also of other codes and across exception runs
+        sequence = b"acgtACGTACnnnNNNGTacgtrykACGTTTTTTTTTTTTnACGTa"
+        with self.write_packed(sequence) as seq_file:
+            self.assertEqual(list(seq_file.sections["masked.starts"]), [0, 10, 18, 40, 45])
+            self.assertEqual(list(seq_file.sections["masked.ends"]), [4, 13, 25, 41, 46])
+            self.check_all_reads(seq_file, sequence)
+
+    def test_packed_random_sequence(self):
+        rand = random.Random(0)
+        sequence = bytes(rand.choice(b"ACGTACGTACGTNnacgtRY") for _ in range(300))
+        with self.write_packed(sequence) as seq_file:
+            self.check_all_reads(seq_file, sequence)
+
+    def test_empty_sequence(self):
+        with self.write_packed(b"") as seq_file:
+            self.assertEqual(len(seq_file), 0)
+            self.assertEqual(seq_file.read(0, 10), b"")
+
+    def test_blocks(self):
+        sequence = bytes(random.Random(1).choice(b"ACGTNacgt") for _ in range(100))
+        for codec in ["none", "gzip"]:
+            with self.subTest(codec=codec):
+                path = os.path.join(self.seq_dir, codec + ".seq")
+                write_sequence(path, sequence, get_codec(codec), block_size=16)
+                with SequenceFile(path) as seq_file:
+                    self.assertEqual(seq_file.format, "blocks")
+                    self.check_all_reads(seq_file, sequence)
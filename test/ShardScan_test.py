@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from AssemblyAPI import ShardScan
+from AssemblyAPI.Codecs import get_codec
+from AssemblyAPI.ContigIndex import ContigIndex, ContigIndexWriter
+from AssemblyAPI.ShardScan import ShardScanner, match_rows
+
+
+class ShardScannerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.index_dir, "abc_assembly.idx")
+        with ContigIndexWriter(cls.path, shard_rows=70) as writer:
+            for pos in range(500):
+                writer.add(f"node_{pos}", "plasmid" if pos % 7 == 0 else f"chromosome {pos}",
+                           1000 + pos, 0.5, 0, 0, f"md5_{pos}")
+            writer.write()
+        cls.scanner = ShardScanner(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.index_dir)
+
+    def test_scan_matches_in_process_match(self):
+        queries = [[(None, "plasmid", False)],
+                   [(None, "node_1", False)],
+                   [(None, "chromosome", False), ("contig_id", "node_4", True)],
+                   [("description", "plasmid", False)],
+                   [(None, "nothing", False)]]
+        with ContigIndex(self.path) as index:
+            self.assertGreater(len(index.get_shards()), 1)
+            self.assertTrue(self.scanner.is_enabled(index))
+            for query_terms in queries:
+                with self.subTest(query_terms=query_terms):
+                    expected = match_rows(index, 0, len(index), query_terms)
+                    self.assertEqual(self.scanner.scan(index, get_codec("none"), query_terms),
+                                     expected)
+        # matched by the worker processes
+        self.assertIsNotNone(self.scanner._pool)
+
+    def test_python_found_under_uwsgi(self):
+        with mock.patch.object(sys, "executable", "/usr/local/bin/uwsgi"):
+            python = ShardScan.find_python()
+        self.assertIsNotNone(python)
+        self.assertTrue(os.path.basename(python).startswith("python"))
+        with mock.patch.object(ShardScan, "find_python", return_value=None):
+            scanner = ShardScanner(2)
+        with ContigIndex(self.path) as index:
+            self.assertFalse(scanner.is_enabled(index))
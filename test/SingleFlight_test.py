@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from AssemblyAPI.SingleFlight import FileLock, SingleFlight
+
+
+def build_once(lock_dir, result_path, count_path):
+    """Build the result file through a SingleFlight, counting the builds."""
+    def build():
+        with open(count_path, "a") as outfile:
+            outfile.write("x")
+        time.sleep(0.2)
+        with open(result_path, "w") as outfile:
+            outfile.write("done")
+
+    SingleFlight(lock_dir).run("key", lambda: os.path.exists(result_path), build)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lock_dir)
+        self.result_path = os.path.join(self.lock_dir, "result")
+        self.count_path = os.path.join(self.lock_dir, "count")
+
+    def get_num_builds(self):
+        with open(self.count_path) as infile:
+            return len(infile.read())
+
+    def test_built_once_by_threads(self):
+        single_flight = SingleFlight(self.lock_dir)
+        results = []
+
+        def build():
+            time.sleep(0.2)
+            results.append("built")
+
+        threads = [threading.Thread(target=single_flight.run,
+                                    args=("key", lambda: bool(results), build))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["built"])
+        # neither the lock of the key nor its lock file are kept
+        self.assertEqual(single_flight._locks, {})
+        self.assertFalse(os.path.exists(single_flight.get_lock_file("key")))
+
+    def test_built_once_by_processes(self):
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=build_once,
+                                     args=(self.lock_dir, self.result_path, self.count_path))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.get_num_builds(), 1)
+        build_once(self.lock_dir, self.result_path, self.count_path)
+        self.assertEqual(self.get_num_builds(), 1)
+
+    def test_failed_build_retried(self):
+        single_flight = SingleFlight(self.lock_dir)
+        results = []
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            single_flight.run("key", lambda: bool(results), fail)
+        single_flight.run("key", lambda: bool(results), lambda: results.append("built"))
+        self.assertEqual(results, ["built"])
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir)
+        self.path = os.path.join(lock_dir, "test.lock")
+
+    def test_shared_and_exclusive(self):
+        first = FileLock(self.path, shared=True)
+        second = FileLock(self.path, shared=True)
+        exclusive = FileLock(self.path)
+        self.assertTrue(first.acquire(blocking=False))
+        self.assertTrue(second.acquire(blocking=False))
+        self.assertFalse(exclusive.acquire(blocking=False))
+        first.release()
+        self.assertFalse(exclusive.acquire(blocking=False))
+        second.release()
+        with exclusive:
+            self.assertFalse(first.acquire(blocking=False))
+        self.assertTrue(first.acquire(blocking=False))
+        first.release()
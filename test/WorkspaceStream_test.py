@@ -0,0 +1,64 @@
+import json
+import unittest
+
+from AssemblyAPI.WorkspaceStream import JSONStreamReader
+
+
+def split_every(data, size):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+class JSONStreamReaderTest(unittest.TestCase):
+
+    def read_items(self, value, path, chunk_size):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        return list(JSONStreamReader(split_every(data, chunk_size)).iter_items(path))
+
+    def check_all_splits(self, value, path, expected):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        for chunk_size in range(1, len(data) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.read_items(value, path, chunk_size), expected)
+
+    def test_numbers_split_across_chunks(self):
+        numbers = [0, -7, 1234567890123456789, 3.25, -0.5e-7, 6.02e23, 1e300]
+        self.check_all_splits({"values": numbers}, ["values"], numbers)
+        # a number at the very end of a chunk is not cut short
+        data = b"[1, 23, 456]"
+        for split in range(1, len(data)):
+            with self.subTest(split=split):
+                reader = JSONStreamReader([data[:split], data[split:]])
+                self.assertEqual(list(reader.iter_items([])), [1, 23, 456])
+
+    def test_escapes_split_across_chunks(self):
+        strings = ['quote " and backslash \\', "tab\tnew\nline", "é\u0000",
+                   "surrogate pair \U0001F600", "slash \\/ and \\u0041"]
+        data = json.dumps({"values": strings}).encode("utf-8")  # \uXXXX escapes
+        for chunk_size in range(1, 12):
+            with self.subTest(chunk_size=chunk_size):
+                reader = JSONStreamReader(split_every(data, chunk_size))
+                self.assertEqual(list(reader.iter_items(["values"])), strings)
+
+    def test_multibyte_utf8_split_across_chunks(self):
+        contigs = {"cü": {"description": "ünïcøde 中文 \U0001F9EC"},
+                   "c2": {"description": "}\"]"}}
+        self.check_all_splits({"contigs": contigs}, ["contigs"], list(contigs.values()))
+
+    def test_empty_containers(self):
+        for value in ({}, []):
+            with self.subTest(value=value):
+                self.assertEqual(self.read_items({"contigs": value}, ["contigs"], 1), [])
+        nested = [{}, [], {"a": []}, [{}], ""]
+        self.check_all_splits({"x": {}, "y": nested}, ["y"], nested)
+        with self.assertRaises(ValueError):
+            self.read_items({"data": []}, ["data", 0], 3)
+
+    def test_path(self):
+        response = {"version": "1.1", "result": [{"data": [{"info": [1, "}"],
+                                                            "data": {"contigs": {"a": 1}}}]}]}
+        self.assertEqual(self.read_items(response, ["result", 0, "data", 0, "data", "contigs"],
+                                         5), [1])
+        with self.assertRaises(ValueError):
+            self.read_items(response, ["error"], 5)
+        with self.assertRaises(ValueError):
+            self.read_items({"result": 1}, ["result"], 5)